@@ -11,8 +11,7 @@ import sqlite3
 import os
 import sys
 import logging
-from collections.abc import Collection
-import math
+from collections.abc import Iterable
 
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
@@ -20,78 +19,200 @@ log.addHandler(logging.NullHandler())
 # Helper functions
 
 
-def _print_list(entries: Collection) -> None:
+def _print_list(entries: Iterable, count: int) -> None:
     """Print a list nicely.
 
     args:
-        entries: The list to print.
+        entries: The entries to print. This can be a cursor, the entries are
+          consumed one by one.
+        count: The number of entries.
     """
 
-    if len(entries) < 1:
-        return
-    # Get the maximum length of size. Add two to count for the ending ")" and
-    # for the last number.
-    alignment = int(math.log10(len(entries))) + 2
+    # Align all numbers to the width of the largest one. The padding is done
+    # by the logging formatting itself.
+    width = len(str(count))
     for num, i in enumerate(entries, 1):
-        log.info("%s %s", (str(num) + ")").ljust(alignment), i)
+        log.info("%*d) %s", width, num, i)
 
 
-def _check_uniqueness(cur: sqlite3.Cursor, table: str, field: str) -> bool:
-    """Check whether all entries in field in table are unique.
+# Names of all tables of the database.
+_TABLES = ("meta", "icon_mapping", "favicons", "favicon_bitmaps")
+
+
+def _null_queries(cur: sqlite3.Cursor) -> dict[str, str]:
+    """Get queries listing all records of each table which contain NULL.
+
+    Columns declared NOT NULL can't contain NULL and aren't checked. Tables
+    which have only such columns don't get a query at all.
+
+    Args:
+        cur: sqlite3 cursor to use for querying the columns of tables.
+
+    Returns:
+        A dictionary whose keys are table names and whose values are the
+        SELECT queries.
+    """
+
+    # Get all columns of all tables at once.
+    placeholders = ", ".join("?" * len(_TABLES))
+    cur.execute(
+        'SELECT tbl.name, col.name, col.type, col."notnull" '
+        "FROM sqlite_schema AS tbl, pragma_table_info(tbl.name) AS col "
+        f"WHERE tbl.type = 'table' AND tbl.name IN ({placeholders}) "
+        "ORDER BY tbl.name, col.cid",
+        _TABLES,
+    )
+    columns: dict[str, list[tuple[str, str, int]]] = {}
+    for table, *column in cur.fetchall():
+        columns.setdefault(table, []).append(tuple(column))
+
+    queries = {}
+    for table, table_columns in columns.items():
+        # Please don't do an SQL injection attack here. (It's impossible to
+        # use ? substitution in this context.)
+        # This should look like this:
+        # column1 IS NULL OR column2 IS NULL OR column3 IS NULL
+        condition = " OR ".join(
+            name + " IS NULL"
+            for name, _, notnull in table_columns
+            if not notnull
+        )
+        if not condition:
+            continue
+        # Listing whole images isn't useful, list their size instead.
+        fields = ", ".join(
+            f"length({name})" if column_type == "BLOB" else name
+            for name, column_type, _ in table_columns
+        )
+        queries[table] = f"SELECT {fields} FROM {table} WHERE {condition}"
+    return queries
+
+
+def _duplicates_query(table: str, field: str) -> str:
+    """Get a query listing all records of table with non-unique field.
 
     Args:
-        cur: sqlite3 cursor to use for checking.
         table: Table whose field should be checked.
         field: Field to check.
 
     Returns:
-        True if field is unique, False otherwise.
+        The SELECT query.
     """
 
-    # Please don't do SQL injection attacks here. (It's impossible to use ?
-    # substitution in this context.)
-    cur.execute(f"SELECT * FROM {table} GROUP BY {field} HAVING COUNT(*) > 1")
+    # Again please don't do SQL injection attacks here.
+    return (
+        f"SELECT {field}, COUNT(*) FROM {table} GROUP BY {field} "
+        "HAVING COUNT(*) > 1"
+    )
 
-    entries = cur.fetchall()
-    if entries:
-        log.error(
-            "Database has %d duplicate records in '%s'!", len(entries), table
-        )
 
-        log.info("Listing defective entries:")
-        _print_list(entries)
-        return False
-    return True
+def _defect_queries(cur: sqlite3.Cursor) -> dict[str, str]:
+    """Get queries listing defective records of the database.
 
+    Args:
+        cur: sqlite3 cursor to use for building the queries.
+
+    Returns:
+        A dictionary whose keys are names of the queries and whose values are
+        the SELECT queries themselves.
+    """
+
+    queries = {
+        f"{table} nulls": query for table, query in _null_queries(cur).items()
+    }
+    queries["icon_mapping duplicates"] = _duplicates_query(
+        "icon_mapping", "page_url"
+    )
+    queries["favicons duplicates"] = _duplicates_query("favicons", "url")
+    queries["width height mismatch"] = (
+        "SELECT id, icon_id, width, height FROM favicon_bitmaps "
+        "WHERE width != height"
+    )
+    queries["wrong width"] = (
+        "SELECT id, icon_id, width, height FROM favicon_bitmaps "
+        "WHERE width NOT IN (16, 32)"
+    )
+    queries["wrong icon count"] = (
+        "SELECT icon_id, COUNT(*) FROM favicon_bitmaps GROUP BY icon_id "
+        "HAVING COUNT(*) != 2"
+    )
+    queries["favicons bitmap count"] = (
+        "SELECT fav.id, COUNT(bitmap.id) FROM favicons AS fav "
+        "LEFT JOIN favicon_bitmaps AS bitmap ON bitmap.icon_id = fav.id "
+        "GROUP BY fav.id HAVING COUNT(bitmap.id) != 2"
+    )
+    queries["unbound favicon_bitmaps"] = (
+        "SELECT bitmap.id, bitmap.icon_id FROM favicon_bitmaps AS bitmap "
+        "LEFT JOIN favicons AS fav ON fav.id = bitmap.icon_id "
+        "WHERE fav.id IS NULL"
+    )
+    queries["unmatched icon_mapping"] = (
+        "SELECT map.id, map.page_url, map.icon_id FROM icon_mapping AS map "
+        "LEFT JOIN favicons AS fav ON fav.id = map.icon_id "
+        "WHERE fav.id IS NULL"
+    )
+    return queries
 
-def _check_null_in_table(cur: sqlite3.Cursor, table: str) -> bool:
-    """Check that table don't contain NULL.
+
+def _count_records(
+    cur: sqlite3.Cursor, queries: dict[str, str]
+) -> dict[str, int]:
+    """Count the records returned by queries.
+
+    All queries are counted in a single statement instead of running them one
+    by one.
 
     Args:
-        cur: sqlite3 cursor to use for checking.
-        table: Table to check.
+        cur: sqlite3 cursor to use for counting.
+        queries: A dictionary whose keys are names of the queries and whose
+          values are SELECT queries.
 
     Returns:
-        True if all entries don't contain NULL, False otherwise.
+        A dictionary whose keys are names of the queries and whose values are
+        the number of records returned by them.
     """
 
-    # Get all columns in table.
-    cur.execute("SELECT name FROM pragma_table_info(?)", (table,))
-    columns = [column[0] for column in cur.fetchall()]
+    cur.execute(
+        " UNION ALL ".join(
+            f"SELECT ?, COUNT(*) FROM ({query})" for query in queries.values()
+        ),
+        tuple(queries),
+    )
+    return dict(cur.fetchall())
 
-    # Again please don't do an SQL injection attack here.
-    # This should look like this:
-    # column1 IS NULL OR column2 IS NULL OR column3 IS NULL
-    condition = " OR ".join([column + " IS NULL" for column in columns])
 
-    cur.execute(f"SELECT * FROM {table} WHERE {condition}")
-    entries = cur.fetchall()
-    if entries:
-        log.error(
-            "Found %s records containing NULL in table %s!", len(entries), table
-        )
-        log.info("Listing defective entries:")
-        _print_list(entries)
+def _check_records(
+    cur: sqlite3.Cursor,
+    queries: dict[str, str],
+    counts: dict[str, int],
+    name: str,
+    message: str,
+    *args,
+) -> bool:
+    """Check that the query name returns no records.
+
+    The query is only run again to list the defective records when its count
+    is nonzero and when the listing would be logged.
+
+    Args:
+        cur: sqlite3 cursor to use for listing defective records.
+        queries: Queries returned by _defect_queries().
+        counts: Counts of queries returned by _count_records().
+        name: Name of the query to check.
+        message: Error message. It is formatted with the number of defective
+          records followed by args.
+        *args: Additional arguments of message.
+
+    Returns:
+        True if the query returns no records, False otherwise.
+    """
+
+    count = counts[name]
+    if count:
+        log.error(message, count, *args)
+        if log.isEnabledFor(logging.INFO):
+            log.info("Listing defective entries:")
+            _print_list(cur.execute(queries[name]), count)
         return False
     return True
 
@@ -113,15 +234,6 @@ def _check_tables(cur: sqlite3.Cursor) -> bool:
     return True
 
 
-def _check_nulls(cur: sqlite3.Cursor) -> bool:
-    """Check that no record contains NULL."""
-
-    for table in ("meta", "icon_mapping", "favicons", "favicon_bitmaps"):
-        if not _check_null_in_table(cur, table):
-            return False
-    return True
-
-
 def _check_meta_validity(cur: sqlite3.Cursor) -> bool:
     """Check the meta table.
 
@@ -130,8 +242,10 @@ def _check_meta_validity(cur: sqlite3.Cursor) -> bool:
     non-negative.
     """
 
-    cur.execute("SELECT * FROM meta")
-    meta = {key: value for key, value in cur}
+    # All keys are fetched, not just the expected ones, so that extra records
+    # are detected too.
+    cur.execute("SELECT key, value FROM meta")
+    meta = dict(cur)
     found_meta = meta.keys()
     check_meta = {"mmap_status", "version", "last_compatible_version"}
     if found_meta != check_meta:
@@ -161,97 +275,113 @@ def _check_meta_validity(cur: sqlite3.Cursor) -> bool:
     return True
 
 
-def _check_valid_icon_size(cur: sqlite3.Cursor) -> bool:
-    """Check icon sizes of all icons."""
+def _check_nulls(
+    cur: sqlite3.Cursor, queries: dict[str, str], counts: dict[str, int]
+) -> bool:
+    """Check that no record contains NULL."""
 
-    cur.execute("SELECT * FROM favicon_bitmaps WHERE width != height")
-    width_height_mismatch = cur.fetchall()
-    if width_height_mismatch:
-        log.error(
-            "%d record(s) in favicon_bitmaps have non-matching width and "
-            "height!",
-            len(width_height_mismatch),
-        )
-        log.info("Listing defective entries:")
-        _print_list(width_height_mismatch)
-        return False
+    for table in _TABLES:
+        # Tables without nullable columns don't have a query.
+        if f"{table} nulls" not in queries:
+            continue
+        if not _check_records(
+            cur,
+            queries,
+            counts,
+            f"{table} nulls",
+            "Found %s records containing NULL in table %s!",
+            table,
+        ):
+            return False
+    return True
 
-    cur.execute("SELECT * FROM favicon_bitmaps WHERE width NOT IN (16, 32);")
-    wrong_width = cur.fetchall()
-    if wrong_width:
-        log.error(
-            "%d record(s) in favicon_bitmaps have nonstandard dimensions!",
-            len(wrong_width),
-        )
-        log.info("Listing defective entries:")
-        _print_list(wrong_width)
-        return False
+
+def _check_uniqueness(
+    cur: sqlite3.Cursor, queries: dict[str, str], counts: dict[str, int]
+) -> bool:
+    """Check that website URLs and favicon URLs are unique."""
+
+    for table in ("icon_mapping", "favicons"):
+        if not _check_records(
+            cur,
+            queries,
+            counts,
+            f"{table} duplicates",
+            "Database has %d duplicate records in '%s'!",
+            table,
+        ):
+            return False
     return True
 
 
-def _check_correct_number_of_icons_per_entry(cur: sqlite3.Cursor) -> bool:
+def _check_valid_icon_size(
+    cur: sqlite3.Cursor, queries: dict[str, str], counts: dict[str, int]
+) -> bool:
+    """Check icon sizes of all icons."""
+
+    if not _check_records(
+        cur,
+        queries,
+        counts,
+        "width height mismatch",
+        "%d record(s) in favicon_bitmaps have non-matching width and height!",
+    ):
+        return False
+    return _check_records(
+        cur,
+        queries,
+        counts,
+        "wrong width",
+        "%d record(s) in favicon_bitmaps have nonstandard dimensions!",
+    )
+
+
+def _check_correct_number_of_icons_per_entry(
+    cur: sqlite3.Cursor, queries: dict[str, str], counts: dict[str, int]
+) -> bool:
     """Check that each icon has exactly two favicon bitmaps."""
 
-    cur.execute(
-        "SELECT * FROM favicon_bitmaps GROUP BY icon_id HAVING COUNT(*) != 2"
+    return _check_records(
+        cur,
+        queries,
+        counts,
+        "wrong icon count",
+        "%d record(s) in favicon_bitmaps have wrong number of icon mappings!",
     )
-    icon_id_dup = cur.fetchall()
-    if icon_id_dup:
-        log.error(
-            "%d record(s) in favicon_bitmaps have wrong number of icon "
-            "mappings!",
-            len(icon_id_dup),
-        )
-        log.info("Listing defective entries:")
-        _print_list(icon_id_dup)
-        return False
-    return True
 
 
-def _check_favicons_to_favicon_bitmaps_mapping(cur: sqlite3.Cursor) -> bool:
+def _check_favicons_to_favicon_bitmaps_mapping(
+    cur: sqlite3.Cursor, queries: dict[str, str], counts: dict[str, int]
+) -> bool:
     """Check that each entry in favicons has its entries in favicon_bitmaps."""
 
-    # Check that every favicon has two favicon bitmap entries.
-    cur.execute("SELECT COUNT(*) FROM favicons")
-    favicon_count = cur.fetchone()[0]
-    cur.execute("SELECT COUNT(*) FROM favicon_bitmaps")
-    favicon_bitmaps_count = cur.fetchone()[0]
-
-    if favicon_count * 2 != favicon_bitmaps_count:
-        log.error("Count mismatch between favicons and favicon_bitmaps!")
-        log.info("Number of records in favicons: %d", favicon_count)
-        log.info(
-            "Number of records in favicon_bitmaps: %d", favicon_bitmaps_count
-        )
+    # Check that every favicon has two favicon bitmap entries and that every
+    # favicon bitmap belongs to a favicon.
+    if not _check_records(
+        cur,
+        queries,
+        counts,
+        "favicons bitmap count",
+        "%d favicon(s) don't have exactly two favicon bitmaps!",
+    ):
         return False
 
-    # This checks that each favicon entry has two matching favicon bitmap
-    # entries. If this is true, the number of joint records should be equal to
-    # favicon_bitmaps_count.
-    cur.execute(
-        "SELECT COUNT(*) FROM (SELECT * FROM favicons INNER JOIN "
-        "favicon_bitmaps ON favicon_bitmaps.icon_id = favicons.id)"
-    )
-    join_count = cur.fetchone()[0]
-
-    if join_count != favicon_bitmaps_count:
-        log.error("Unbound favicons are present in database!")
+    if not _check_records(
+        cur,
+        queries,
+        counts,
+        "unbound favicon_bitmaps",
+        "%d unbound favicon bitmap(s) are present in database!",
+    ):
         return False
 
-    cur.execute(
-        "SELECT * FROM icon_mapping WHERE "
-        "icon_id NOT IN (SELECT id FROM favicons)"
+    return _check_records(
+        cur,
+        queries,
+        counts,
+        "unmatched icon_mapping",
+        "%d icon mapping(s) point to nonexistant favicon!",
     )
-    icon_mapping_unmatched = cur.fetchall()
-    if icon_mapping_unmatched:
-        log.error(
-            "%d icon mapping(s) point to nonexistant favicon!",
-            len(icon_mapping_unmatched),
-        )
-        log.info("Listing defective records:")
-        _print_list(icon_mapping_unmatched)
-        return False
-    return True
 
 
 def checkdb(db: sqlite3.Connection) -> bool:
@@ -275,24 +405,26 @@ def checkdb(db: sqlite3.Connection) -> bool:
     if not _check_tables(cur):
         return False
 
-    if not _check_nulls(cur):
+    # All tables are present, the rest of the checks can be counted at once.
+    queries = _defect_queries(cur)
+    counts = _count_records(cur, queries)
+
+    if not _check_nulls(cur, queries, counts):
         return False
 
     if not _check_meta_validity(cur):
         return False
 
-    if not _check_uniqueness(cur, "icon_mapping", "page_url"):
-        return False
-    if not _check_uniqueness(cur, "favicons", "url"):
+    if not _check_uniqueness(cur, queries, counts):
         return False
 
-    if not _check_valid_icon_size(cur):
+    if not _check_valid_icon_size(cur, queries, counts):
         return False
 
-    if not _check_correct_number_of_icons_per_entry(cur):
+    if not _check_correct_number_of_icons_per_entry(cur, queries, counts):
         return False
 
-    if not _check_favicons_to_favicon_bitmaps_mapping(cur):
+    if not _check_favicons_to_favicon_bitmaps_mapping(cur, queries, counts):
         return False
     return True
 
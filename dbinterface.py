@@ -4,7 +4,8 @@ DBInterface's methods should be used in this order:
 1)   Call get_icon_mappings() to get all website URLs which are already saved
      and which do not require further action.
 1.5) Get all website URLs and filter out mappings that we got in the previous
-     step. Query favicon URLs of filtered website URLs.
+     step (get_unmapped_urls() does steps 1 and 1.5 at once). Query favicon
+     URLs of filtered website URLs.
 2)   Call merge_existing_icons() with the filtered mapping we got from the
      previous step. Save the return value and use it in next steps.
 2.5) Fetch favicon images of links we got in the previous step.
@@ -12,6 +13,8 @@ DBInterface's methods should be used in this order:
 4)   Call merge_existing_icons() with the rest of the website and favicon URLs.
      merge_existing_icons() should now return an empty list because all
      favicons should already be present in the database.
+     add_icons_and_link() does steps 3 and 4 at once without returning
+     anything.
 
 Following these instructions will guarantee that no data which is already saved
 in the database would have to be fetched again. Almost every step filters out
@@ -24,6 +27,7 @@ that are in the list.
 
 import sqlite3
 import contextlib
+import json
 from collections import abc
 
 from base_types import *
@@ -58,14 +62,19 @@ def _populate_temporary_table(
 ) -> None:
     """Create a temporary table favicon_query containing new entries."""
 
+    # The table is joined on favicon_url with favicons. Making it the leading
+    # column of the primary key keeps the table ordered by it so no separate
+    # index is needed. website_url is unique so the key is unique as well.
     cur.execute(
         "CREATE TEMPORARY TABLE favicon_query(favicon_url TEXT NOT NULL, "
-        "website_url TEXT NOT NULL)"
+        "website_url TEXT NOT NULL, PRIMARY KEY(favicon_url, website_url)) "
+        "WITHOUT ROWID"
     )
+    # Pass the whole mapping as a single JSON object and let SQLite unpack it.
     # This swaps key and value and inserts it into the temporary table.
-    cur.executemany(
-        "INSERT INTO favicon_query VALUES(?, ?)",
-        ((v, k) for k, v in icon_map.items()),
+    cur.execute(
+        "INSERT INTO favicon_query SELECT value, key FROM json_each(?)",
+        (json.dumps(icon_map),),
     )
 
 
@@ -87,67 +96,50 @@ def _check_icon_mapping_collision(cur: sqlite3.Cursor) -> None:
         )
 
 
-def _get_id(cur: sqlite3.Cursor, id: str, table: str) -> int:
-    """Get the next id from table.
+def _get_next_icon_ids(cur: sqlite3.Cursor) -> tuple[int, int]:
+    """Get the next free ids of favicons and favicon_bitmaps.
 
     Args:
         cur: Databse cursor.
-        id: Column containing id.
-        table: Table to get id from.
 
     Returns:
-        Id.
+        A tuple containing the next id of favicons and the next id of
+        favicon_bitmaps.
     """
 
-    # Don't do SQL injection attacks here.
-    data = cur.execute(f"SELECT MAX({id}) FROM {table}").fetchone()[0]
-    if data is None:
-        return 1
-    else:
-        # We don't want to overwrite the last entry.
-        return data + 1
+    # Both ids are INTEGER PRIMARY KEY so MAX() is just a lookup of the last
+    # row. We don't want to overwrite the last entry.
+    return cur.execute(
+        "SELECT (SELECT COALESCE(MAX(id), 0) FROM favicons) + 1, "
+        "(SELECT COALESCE(MAX(id), 0) FROM favicon_bitmaps) + 1"
+    ).fetchone()
 
 
-def _add_saved_icon_mappings(
-    readcur: sqlite3.Cursor, writecur: sqlite3.Cursor
-) -> None:
+def _add_saved_icon_mappings(cur: sqlite3.Cursor) -> None:
     """Add all mappings which have a saved icon into the database."""
 
-    idnum = _get_id(readcur, "id", "icon_mapping")
-
-    # Select all website URLs whose favicon is already marked in the
-    # favicons table. url in favicons must be unique so all mathing entries
-    # will be selected only once.
-    found = readcur.execute(
-        "SELECT search.website_url, fav.id FROM favicons AS fav "
-        "INNER JOIN favicon_query AS search ON fav.url = search.favicon_url"
+    # Add mappings from all website URLs whose favicon is already marked in
+    # the favicons table. url in favicons must be unique so all mathing entries
+    # will be selected only once. id is INTEGER PRIMARY KEY, leaving it out
+    # makes SQLite assign the next free ids (MAX(id) + 1 and onwards).
+    cur.execute(
+        "INSERT INTO icon_mapping(page_url, icon_id) "
+        "SELECT search.website_url, fav.id "
+        "FROM favicons AS fav INNER JOIN favicon_query AS search "
+        "ON fav.url = search.favicon_url"
     )
 
-    # This makes the type checker happy.
-    url: str
-    id: int
-    # Add mappings from website URLs to favicon URLs which are already
-    # present in the database.
-    record: tuple[str, int]
-    for record in iter(found.fetchone, None):
-        # This makes the type checker happy.
-        assert record is not None
-        url, id = record
-        writecur.execute(
-            "INSERT INTO icon_mapping VALUES(?, ?, ?)", (idnum, url, id)
-        )
-        idnum += 1
-
 
 def _return_unsaved_entries(cur: sqlite3.Cursor) -> list[website_url]:
     """Return all new favicon mappings which don't have a saved favicon."""
 
     not_found = cur.execute(
-        "SELECT website_url, favicon_url FROM favicon_query "
-        "WHERE favicon_url NOT IN (SELECT url FROM favicons)"
+        "SELECT search.website_url FROM favicon_query AS search "
+        "LEFT JOIN favicons AS fav ON fav.url = search.favicon_url "
+        "WHERE fav.id IS NULL"
     )
 
-    return [row[0] for row in not_found.fetchall()]
+    return [row[0] for row in not_found]
 
 
 # Chromium stores all relevant data in the Favicons SQLite database. It
@@ -182,7 +174,11 @@ class DBInterface(contextlib.AbstractContextManager):
 
             self._db = newdb
         else:
-            self._db = sqlite3.connect(path, isolation_level="EXCLUSIVE")
+            self._db = sqlite3.connect(path)
+
+        # Transactions are handled explicitly. All work is done in a single
+        # transaction started below and committed in close().
+        self._db.isolation_level = None
 
         # This cursor is intended for all write operations to the database (and
         # for basic querying). It is committed at the very end of DBInterface's
@@ -204,6 +200,20 @@ class DBInterface(contextlib.AbstractContextManager):
                 f"{compatible_version}"
             )
 
+        # These settings only affect this connection. Keep the temporary table
+        # in memory and allow a larger page cache (the value is in KiB) for the
+        # bulk operations. The journal mode is left alone on purpose, it would
+        # persist in the database file which belongs to Chromium.
+        cur.execute("PRAGMA temp_store = MEMORY")
+        cur.execute("PRAGMA cache_size = -20000")
+
+        # Take the write lock right away so that the whole session, including
+        # the temporary table, is a single transaction.
+        try:
+            cur.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError as exc:
+            raise LockedDatabaseError("Database is locked.") from exc
+
     def get_icon_mappings(self) -> set[website_url]:
         """Get all saved icon mappings.
 
@@ -217,7 +227,31 @@ class DBInterface(contextlib.AbstractContextManager):
 
         cur = self._cur
         res = cur.execute("SELECT page_url FROM icon_mapping")
-        return {x[0] for x in res.fetchall()}
+        return {x[0] for x in res}
+
+    def get_unmapped_urls(
+        self, urls: abc.Iterable[website_url]
+    ) -> set[website_url]:
+        """Filter out website URLs which already have a saved icon mapping.
+
+        This is equivalent to set(urls) - get_icon_mappings(), but the
+        database is searched using its index instead of loading all saved
+        mappings.
+
+        Args:
+            urls: Website URLs to filter.
+
+        Returns:
+            Website URLs from urls which aren't in get_icon_mappings().
+        """
+
+        res = self._cur.execute(
+            "SELECT DISTINCT url.value FROM json_each(?) AS url "
+            "WHERE NOT EXISTS (SELECT 1 FROM icon_mapping AS map "
+            "WHERE map.page_url = url.value)",
+            (json.dumps(list(urls)),),
+        )
+        return {x[0] for x in res}
 
     def merge_existing_icons(
         self, icon_map: dict[website_url, favicon_url]
@@ -247,11 +281,7 @@ class DBInterface(contextlib.AbstractContextManager):
         _populate_temporary_table(cur, icon_map)
         _check_icon_mapping_collision(cur)
 
-        # We need a second cursor to both read and write to the database at
-        # once.
-        readcur = self._db.cursor()
-        _add_saved_icon_mappings(readcur, cur)
-        readcur.close()
+        _add_saved_icon_mappings(cur)
 
         not_found = _return_unsaved_entries(cur)
         cur.execute("DROP TABLE favicon_query")
@@ -277,48 +307,96 @@ class DBInterface(contextlib.AbstractContextManager):
             ValueError: If icons contain duplicate entries.
         """
 
-        if len(list(icons)) != len({item[0] for item in icons}):
-            raise ValueError("Tried to add an icon more than once.")
-
         cur = self._cur
         # Get next IDs.
-        favicons_id = _get_id(cur, "id", "favicons")
-        bitmaps_id = _get_id(cur, "id", "favicon_bitmaps")
-        # Insert an entry into favicons and insert two icons per entry.
+        favicons_id, bitmaps_id = _get_next_icon_ids(cur)
+        # Prepare an entry for favicons and two icons per entry and insert
+        # them all at once.
+        favicon_rows = []
+        bitmap_rows = []
+        # icons can be a one-shot iterator, duplicates are checked while
+        # building the rows. Nothing is inserted if a duplicate is found.
+        seen_urls = set()
         for url, icon in icons:
-            cur.execute(
-                "INSERT INTO favicons VALUES(?, ?, 1)", (favicons_id, url)
-            )
-            cur.execute(
-                "INSERT INTO favicon_bitmaps VALUES(?, ?, 0, ?, 16, 16, 0)",
-                (bitmaps_id, favicons_id, icon.x16),
-            )
-            bitmaps_id += 1
-            cur.execute(
-                "INSERT INTO favicon_bitmaps VALUES(?, ?, 0, ?, 32, 32, 0)",
-                (bitmaps_id, favicons_id, icon.x32),
-            )
-            bitmaps_id += 1
+            if url in seen_urls:
+                raise ValueError("Tried to add an icon more than once.")
+            seen_urls.add(url)
+            favicon_rows.append((favicons_id, url))
+            bitmap_rows.append((bitmaps_id, favicons_id, icon.x16, 16, 16))
+            bitmap_rows.append((bitmaps_id + 1, favicons_id, icon.x32, 32, 32))
+            bitmaps_id += 2
             favicons_id += 1
+        cur.executemany("INSERT INTO favicons VALUES(?, ?, 1)", favicon_rows)
+        cur.executemany(
+            "INSERT INTO favicon_bitmaps VALUES(?, ?, 0, ?, ?, ?, 0)",
+            bitmap_rows,
+        )
+
+    def add_icons_and_link(
+        self,
+        icon_map: dict[website_url, favicon_url],
+        icons: abc.Iterable[tuple[favicon_url, icon.IconPair]],
+    ) -> None:
+        """Add new icons to the database and map websites to them.
+
+        This is add_new_icons() followed by merge_existing_icons() which
+        doesn't look for website URLs left without an icon. Websites in
+        icon_map whose favicon is neither in icons nor in the database are
+        silently skipped.
+
+        The same restrictions as in add_new_icons() and merge_existing_icons()
+        apply.
+
+        Args:
+            icon_map: A dictionary whose key is website URL and whose value is
+              key's favicon URL.
+            icons: An iterable of tuples of favicon URLs and favicons.
+
+        Raises:
+            ValueError: If icons contain duplicate entries or if
+              icon_map.keys() contains url listed in get_icon_mappings().
+        """
+
+        self.add_new_icons(icons)
+
+        cur = self._cur
+        _populate_temporary_table(cur, icon_map)
+        _check_icon_mapping_collision(cur)
+        _add_saved_icon_mappings(cur)
+        cur.execute("DROP TABLE favicon_query")
 
     def close(self) -> None:
-        """Close the database connection.
+        """Commit all changes and close the database connection.
 
         Do not use DBInterface's methods after close() has been called.
         """
 
+        self._cur.execute("COMMIT")
+        self._cur.close()
+        self._db.close()
+
+    def rollback(self) -> None:
+        """Discard all changes and close the database connection.
+
+        Do not use DBInterface's methods after rollback() has been called.
+        """
+
+        self._cur.execute("ROLLBACK")
         self._cur.close()
-        self._db.commit()
         self._db.close()
 
     def __exit__(self, exc_type, exc_val, exc_tb) -> None:
         """Deinitialize DBInterface.
 
-        Calls self.close(). All arguments are ignored.
+        Calls self.close() or self.rollback() if an exception has been raised.
+        This means that nothing is saved when the program is interrupted.
 
         Returns:
             False.
         """
 
-        self.close()
+        if exc_type is None:
+            self.close()
+        else:
+            self.rollback()
         return None
@@ -0,0 +1,121 @@
+"""Persistent cache of bookmarks whose favicon couldn't be found.
+
+Bookmarks which point to dead websites (or to websites without a favicon) would
+otherwise be queried again on every run of load_bookmark_favicons, often
+waiting for the whole timeout. DeadLinkCache remembers them in its own SQLite
+file (Chromium's Favicons database is never used for this) and tells which of
+them should be skipped.
+
+Each failure postpones the next retry of the link. The delay doubles with every
+consecutive failure (starting at _BASE_DELAY, up to _MAX_DELAY). A link is
+forgotten as soon as its favicon is found.
+"""
+
+import sqlite3
+import contextlib
+import time
+from collections.abc import Iterable
+
+from base_types import *
+
+# Delays in seconds.
+_BASE_DELAY = 24 * 60 * 60
+_MAX_DELAY = 30 * 24 * 60 * 60
+
+
+class DeadLinkCache(contextlib.AbstractContextManager):
+    """Interface to the dead link cache file."""
+
+    def __init__(self, path: str):
+        """Initialize DeadLinkCache.
+
+        Args:
+            path: Path to the cache file. It is created if it doesn't exist.
+        """
+
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dead_links("
+            "url TEXT PRIMARY KEY NOT NULL, "
+            "failures INTEGER NOT NULL, "
+            "retry_after REAL NOT NULL)"
+        )
+
+    def filter_dead(
+        self, urls: Iterable[website_url], now: float | None = None
+    ) -> set[website_url]:
+        """Filter out links which shouldn't be retried yet.
+
+        Args:
+            urls: Links to filter.
+            now: Current time (as returned by time.time()). It's used for
+              testing.
+
+        Returns:
+            Links from urls which aren't in the cache or whose retry delay has
+            passed.
+        """
+
+        if now is None:
+            now = time.time()
+        dead = {
+            x[0]
+            for x in self._db.execute(
+                "SELECT url FROM dead_links WHERE retry_after > ?", (now,)
+            )
+        }
+        return {url for url in urls if url not in dead}
+
+    def add(
+        self, urls: Iterable[website_url], now: float | None = None
+    ) -> None:
+        """Record a failure of links.
+
+        Args:
+            urls: Links whose favicon couldn't be found.
+            now: Current time (as returned by time.time()). It's used for
+              testing.
+        """
+
+        if now is None:
+            now = time.time()
+        self._db.executemany(
+            "INSERT INTO dead_links VALUES(?1, 1, ?2 + ?3) "
+            "ON CONFLICT(url) DO UPDATE SET "
+            "failures = failures + 1, "
+            "retry_after = ?2 + min(?3 << min(failures, 16), ?4)",
+            ((url, now, _BASE_DELAY, _MAX_DELAY) for url in urls),
+        )
+
+    def remove(self, urls: Iterable[website_url]) -> None:
+        """Forget links whose favicon has been found.
+
+        Args:
+            urls: Links to forget.
+        """
+
+        self._db.executemany(
+            "DELETE FROM dead_links WHERE url = ?", ((url,) for url in urls)
+        )
+
+    def close(self) -> None:
+        """Save all changes and close the cache file.
+
+        Do not use DeadLinkCache's methods after close() has been called.
+        """
+
+        self._db.commit()
+        self._db.close()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        """Deinitialize DeadLinkCache.
+
+        Calls self.close(). Unlike DBInterface, the cache is saved even when
+        an exception has been raised, the recorded failures are still valid.
+
+        Returns:
+            False.
+        """
+
+        self.close()
+        return None
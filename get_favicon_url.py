@@ -4,13 +4,25 @@ This module provides a logger (which is set to NullHandler by default) with the
 same name as the module."""
 
 import html.parser
+import codecs
+import itertools
+import re
 import urllib.parse
+import contextlib
 import requests
+import requests.adapters
 import logging
 from base_types import *
 import typing
+import concurrent.futures
+from collections.abc import Iterable, Iterator
 
-import magic
+# lxml is an optional dependency. When it's available, its HTML parser (which
+# is written in C) is used instead of html.parser.
+try:
+    import lxml.etree as _lxml_etree
+except ImportError:
+    _lxml_etree = None  # type: ignore
 
 # Get a silenced logger. The main program can change verbosity with the -v flag
 # which modifies this logger.
@@ -18,6 +30,11 @@ _log = logging.getLogger(__name__)
 _log.addHandler(logging.NullHandler())
 
 
+# Values of the rel attribute of link tags which refer to favicons. They are
+# compared case-insensitively.
+_ICON_RELS = frozenset({"icon", "shortcut icon"})
+
+
 class _StopSearch(Exception):
     """Exception used by _IconHTMLParser to signal end of favicons."""
 
@@ -68,30 +85,28 @@ class _IconHTMLParser(html.parser.HTMLParser):
             attrs: List of XML attributes of the tag.
         """
 
+        # attrs is scanned directly, a dictionary is only built for favicons.
         if tag == "base":
-            attributes = dict(attrs)
-            if "href" not in attributes:
+            for name, value in attrs:
                 # A base tag doesn't have to contain the base URL
-                return
-            assert attributes["href"]
-            self.base_url = attributes["href"]
+                if name == "href":
+                    assert value
+                    self.base_url = value
+                    return
             return
 
         if tag != "link":
             return
 
-        attributes = dict(attrs)
-        # The "sizes" attribute could be useful for picking icons. Not all
-        # websites use it. But now get_favicon_url() just picks the first
-        # favicon found.
-
-        if "rel" not in attributes or (
-            attributes["rel"] != "icon" and attributes["rel"] != "shortcut icon"
-        ):
+        rel = next((value for name, value in attrs if name == "rel"), None)
+        if rel is None or rel.strip().lower() not in _ICON_RELS:
             # Not a favicon.
             return
 
-        self.favicons.append(attributes)
+        # The "sizes" attribute could be useful for picking icons. Not all
+        # websites use it. But now get_favicon_url() just picks the first
+        # favicon found.
+        self.favicons.append(dict(attrs))
 
     def handle_endtag(self, tag: str) -> None:
         """Handle end tags.
@@ -112,8 +127,235 @@ class _IconHTMLParser(html.parser.HTMLParser):
         if not self._ended:
             if tag == "head":
                 self._ended = True
+                # The rest of the buffered page won't be parsed, don't keep it
+                # in memory.
+                self.rawdata = ""
                 raise _StopSearch("No favicons can proceed.")
 
+    def close(self) -> None:
+        """Finish parsing unless the end of head has already been reached."""
+
+        if not self._ended:
+            super().close()
+
+
+# Matches the end tag of head. It's used by _LxmlIconParser, lxml closes head
+# implicitly (on text or a body element for example) and reports it the same
+# way as a real </head>.
+_HEAD_END_RE = re.compile(r"</head[\s/>]", re.IGNORECASE)
+_HEAD_END_BYTES_RE = re.compile(rb"</head[\s/>]", re.IGNORECASE)
+# Length of _HEAD_END_RE's match minus one.
+_HEAD_END_TAIL = 6
+
+
+class _LxmlIconParser:
+    """lxml based parser which searches for favicon URLs with their attributes.
+
+    This is a faster alternative to _IconHTMLParser with the same interface.
+    It's used when lxml is installed. The parser itself calls the start(),
+    end() and close() methods of this class.
+
+    lxml ends the head implicitly when it meets an element which doesn't
+    belong there. Links after such an element would be lost, so the page
+    itself is searched for </head> instead. Everything in front of it is
+    passed to lxml, then _StopSearch is raised like in _IconHTMLParser.
+
+    Attributes:
+        favicons (list[dict[str, str]]): See _IconHTMLParser.
+        base_url (str | None): See _IconHTMLParser.
+    """
+
+    __slots__ = ("favicons", "base_url", "_parser", "_tail")
+
+    def __init__(self) -> None:
+        """Initialize _LxmlIconParser."""
+
+        self.favicons: list[dict[str, str]] = []
+        self.base_url: str | None = None
+        self._parser = _lxml_etree.HTMLParser(target=self)
+        # End of the previous data, </head> can be split between two chunks.
+        self._tail: str | bytes = ""
+
+    def feed(self, data: str | bytes) -> None:
+        """Feed data to the parser.
+
+        Raises:
+            _StopSearch: If </head> is reached.
+        """
+
+        pattern: re.Pattern
+        if isinstance(data, str):
+            pattern = _HEAD_END_RE
+        else:
+            pattern = _HEAD_END_BYTES_RE
+        tail = self._tail if type(self._tail) is type(data) else data[:0]
+        match = pattern.search(tail + data)  # type: ignore
+
+        if match is None:
+            self._tail = (tail + data)[-_HEAD_END_TAIL:]  # type: ignore
+            self._parser.feed(data)
+            return
+
+        # Closing the parser flushes all links buffered by lxml.
+        self._parser.feed(data[: match.end() - len(tail)])
+        self._parser.close()
+        raise _StopSearch("No favicons can proceed.")
+
+    def start(self, tag: str, attrib: dict[str, str]) -> None:
+        """Search for link tags containing favicon URLs with their attributes.
+
+        See _IconHTMLParser.handle_starttag().
+        """
+
+        if tag == "base":
+            if "href" in attrib:
+                self.base_url = attrib["href"]
+            return
+
+        if tag != "link":
+            return
+
+        rel = attrib.get("rel")
+        if rel is None or rel.strip().lower() not in _ICON_RELS:
+            # Not a favicon.
+            return
+
+        self.favicons.append(dict(attrib))
+
+    def close(self) -> None:
+        """Finish parsing. Required by lxml's target interface."""
+
+        return None
+
+
+_IconParser = _IconHTMLParser | _LxmlIconParser
+
+
+def _create_parser() -> _IconParser:
+    """Create the fastest available favicon parser."""
+
+    if _lxml_etree is not None:
+        return _LxmlIconParser()
+    return _IconHTMLParser()
+
+
+# Size of the beginning of a resource which is used to detect (X)HTML.
+_SNIFF_SIZE = 512
+
+# Signatures of HTML documents taken from the WHATWG MIME Sniffing Standard
+# (plus "<meta" which many pages start with). They must appear at the beginning
+# of the document (after whitespace) and must be followed by whitespace or ">".
+_HTML_SIGNATURES = (
+    b"<!doctype html",
+    b"<html",
+    b"<head",
+    b"<script",
+    b"<iframe",
+    b"<h1",
+    b"<div",
+    b"<font",
+    b"<table",
+    b"<a",
+    b"<style",
+    b"<title",
+    b"<b",
+    b"<body",
+    b"<br",
+    b"<p",
+    b"<meta",
+    b"<!--",
+)
+
+
+def _sniff_html(head: bytes) -> str | None:
+    """Detect whether a resource is an (X)HTML document.
+
+    This is a simplified version of the WHATWG MIME Sniffing Standard's HTML
+    detection. XHTML documents are recognised by the XML declaration followed
+    by a html tag.
+
+    Args:
+        head: The beginning of the resource. Only the first _SNIFF_SIZE bytes
+          are examined.
+
+    Returns:
+        "text/html", "application/xhtml+xml" or None if the resource isn't
+        (X)HTML.
+    """
+
+    head = head[:_SNIFF_SIZE].removeprefix(b"\xef\xbb\xbf").lstrip().lower()
+
+    if head.startswith(b"<?xml"):
+        if b"<html" in head:
+            return "application/xhtml+xml"
+        return None
+
+    for signature in _HTML_SIGNATURES:
+        if head.startswith(signature):
+            terminator = head[len(signature) : len(signature) + 1]
+            if terminator in b" \t\n\r\f>":
+                return "text/html"
+    return None
+
+
+def _decode_chunks(
+    chunks: Iterable[bytes], encoding: str | None
+) -> Iterator[str]:
+    """Decode chunks of text incrementally.
+
+    Multi-byte characters can be split between chunks, an incremental decoder
+    handles that.
+
+    Args:
+        chunks: Chunks of encoded text.
+        encoding: Encoding of the text. UTF-8 is used if it's None or unknown.
+
+    Yields:
+        Decoded chunks. Undecodable bytes are replaced.
+    """
+
+    try:
+        decoder_type = codecs.getincrementaldecoder(encoding or "utf-8")
+    except LookupError:
+        decoder_type = codecs.getincrementaldecoder("utf-8")
+    decoder = decoder_type(errors="replace")
+
+    for chunk in chunks:
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def _feed_parser(
+    parser: _IconParser, chunks: Iterable[bytes], encoding: str | None
+) -> None:
+    """Feed chunks of a web page to parser.
+
+    Args:
+        parser: The parser.
+        chunks: Chunks of the web page.
+        encoding: Encoding of the web page if it's known or None.
+
+    Raises:
+        _StopSearch: If the end of head is reached.
+    """
+
+    if isinstance(parser, _IconHTMLParser):
+        # html.parser only accepts str. lxml is fed bytes directly and handles
+        # the encoding itself.
+        for text in _decode_chunks(chunks, encoding):
+            parser.feed(text)
+    else:
+        for chunk in chunks:
+            parser.feed(chunk)
+
+
+# Range of the remote page which is downloaded first. The head of most pages
+# fits into it.
+_HEAD_RANGE = "bytes=0-32767"
+
+# Matches the start of Content-Range, e.g. "bytes 32768-".
+_CONTENT_RANGE_START_RE = re.compile(r"bytes (\d+)-")
+
 
 class UnknownSchemeError(Exception):
     """Exception used by get_favicon_url."""
@@ -127,7 +369,7 @@ class _RetrievalError(Exception):
     """Exception that signals failed retrieval of resource."""
 
 
-def _get_local_file(file_path: str, buffer_size: int) -> _IconHTMLParser | None:
+def _get_local_file(file_path: str, buffer_size: int) -> _IconParser | None:
     """Try to query all favicons of a local web page.
 
     Args:
@@ -139,23 +381,23 @@ def _get_local_file(file_path: str, buffer_size: int) -> _IconHTMLParser | None:
         _RetrievalError: If file doesn't exist or some other error occured.
 
     Returns:
-        A _IconHTMLParser containing all relevant favicon data parsed from file
-        or None if file isn't in (X)HTML format.
+        A parser containing all relevant favicon data parsed from file or None
+        if file isn't in (X)HTML format.
     """
 
     # This isn't really necessary but it makes unbound warnings go away.
     parser = None
 
     try:
-        filetype = magic.from_file(file_path, True)
-        if filetype != "application/xhtml+xml" and filetype != "text/html":
-            return None
+        with open(file_path, "rb") as f:
+            first_chunk = f.read(buffer_size)
+            if _sniff_html(first_chunk) is None:
+                return None
 
-        parser = _IconHTMLParser()
+            parser = _create_parser()
 
-        with open(file_path, "r") as f:
-            while chunk := f.read(buffer_size):
-                parser.feed(chunk)
+            chunks = iter(lambda: f.read(buffer_size), b"")
+            _feed_parser(parser, itertools.chain((first_chunk,), chunks), None)
     except _StopSearch:
         # No favicons can follow, abort parsing.
         pass
@@ -170,21 +412,20 @@ def _get_local_file(file_path: str, buffer_size: int) -> _IconHTMLParser | None:
 
 
 def _get_remote_filetype(
-    data: requests.Response, iter: typing.Iterator[str]
-) -> tuple[str | None, str | None]:
+    data: requests.Response, iter: typing.Iterator[bytes]
+) -> tuple[str | None, bytes | None]:
     """Try to guess the filetype of remote resource.
 
     iter is necessary because _get_remote_filetype might need to fetch the first
     chunk of the resource to determine the filetype. In that case, the chunk
     will be returned to make sure no information is lost.
 
-    This isn't the best approach, websites can lie in Content-Type, magic isn't
-    really meant for this. The correct way would probably be to use mime
-    sniffing.
+    This isn't the best approach, websites can lie in Content-Type. Sniffing is
+    used only when Content-Type is missing.
 
     Args:
         data: Request response.
-        iter: iter_content of the response (Unicode encoded).
+        iter: iter_content of the response.
 
     Returns:
         A tuple containing filetype and the first chunk of the resource.
@@ -197,54 +438,159 @@ def _get_remote_filetype(
         return (data.headers["Content-Type"], None)
     else:
         # If we don't know the Content-Type, fetch the beginning of the
-        # data and use magic to identify it.
+        # data and sniff it.
         chunk = next(iter, None)
         if chunk is None:
             return (None, None)
-        # chunk can apparently sometimes not be str (even when decode_unicode
-        # has been set to True).
-        return (magic.from_buffer(chunk, True), str(chunk))
+        return (_sniff_html(chunk), chunk)
+
+
+def _is_partial(data: requests.Response) -> bool:
+    """Check whether the response contains only a part of the resource.
+
+    Args:
+        data: Request response.
+
+    Returns:
+        True if it's a partial response which doesn't reach the end of the
+        resource, False otherwise.
+    """
+
+    if data.status_code != 206:
+        return False
+
+    # Content-Range looks like "bytes 0-32767/1234567".
+    match = re.fullmatch(
+        r"bytes 0-(\d+)/(\d+)", data.headers.get("Content-Range", "").strip()
+    )
+    return match is None or int(match[1]) + 1 < int(match[2])
+
+
+def _iter_page(
+    chunks: Iterable[bytes],
+    partial: bool,
+    parser: _IconParser,
+    url: website_url,
+    timeout: float | None,
+    buffer_size: int,
+    get: typing.Callable[..., requests.Response],
+) -> Iterator[bytes]:
+    """Yield chunks of a web page, downloading the rest of it if needed.
+
+    If partial is set, chunks contain only the beginning of the page. The
+    rest of the page is requested (from where chunks ended) only if parser
+    hasn't found any favicon in it. Pages often leave out </head>, parsing
+    them to the end would be wasteful.
+
+    Args:
+        chunks: Chunks of the first response.
+        partial: True if chunks don't contain the whole page.
+        parser: The parser which is fed the yielded chunks.
+        url: URL of the page.
+        timeout: Timeout of request. Can be set to None to disable timeout.
+        buffer_size: Size of the buffer which is used for reading the rest of
+          the page.
+        get: Function used for the request (requests.get or Session.get).
+
+    Yields:
+        Chunks of the page.
+    """
+
+    received = 0
+    for chunk in chunks:
+        received += len(chunk)
+        yield chunk
+
+    # The parser has already consumed everything yielded above.
+    if not partial or parser.favicons:
+        return
+
+    _log.debug("No favicon in the first part of '%s'.", url)
+    with get(
+        url,
+        headers={"Range": f"bytes={received}-"},
+        timeout=timeout,
+        stream=True,
+    ) as data:
+        if data.status_code == 416:
+            # Range Not Satisfiable, there's nothing more.
+            return
+        data.raise_for_status()
+
+        # The server doesn't have to honor the Range header, skip the part
+        # which has already been received.
+        skip = received
+        if data.status_code == 206:
+            match = _CONTENT_RANGE_START_RE.match(
+                data.headers.get("Content-Range", "").strip()
+            )
+            if match is None or int(match[1]) > received:
+                _log.debug("Unexpected Content-Range of '%s'.", url)
+                return
+            skip -= int(match[1])
+
+        for chunk in data.iter_content(buffer_size):
+            if skip >= len(chunk):
+                skip -= len(chunk)
+                continue
+            yield chunk[skip:]
+            skip = 0
 
 
 def _get_remote_file(
-    url: website_url, timeout: float | None, buffer_size: int
-) -> tuple[_IconHTMLParser | None, website_url | None]:
+    url: website_url,
+    timeout: float | None,
+    buffer_size: int,
+    session: requests.Session | None = None,
+) -> tuple[_IconParser | None, website_url | None]:
     """Try to query all favicons of a remote web page.
 
+    Only the beginning of the page is requested at first. See _iter_page().
+
     Args:
         url: URL pointing to the resource.
         timeout: Timeout of request. Can be set to None to disable timeout.
         buffer_size: Size of the buffer which is used for reading the remote
-          file. Must be >= 2048.
+          file. Must be >= _SNIFF_SIZE.
+        session: Session used for the request. A new connection is made for
+          the request if None.
 
     Raises:
         _RetrievalError: If remote file couldn't be accessed.
         TimedOutError: If request timed out.
 
     Returns:
-        A _IconHTMLParser containing all relevant favicon data parsed from web
-        page or None if the resource isn't in (X)HTML format. If redirection
+        A parser containing all relevant favicon data parsed from web page or
+        None if the resource isn't in (X)HTML format. If redirection
         occured during resolving of url, the returned url will contain the final
         url.
     """
 
-    # magic needs at least 2048 bits to work.
-    if buffer_size < 2048:
-        raise ValueError("buffer_size must be >= 2048.")
-
-    parser = _IconHTMLParser()
+    # The first chunk must be large enough to be sniffed.
+    if buffer_size < _SNIFF_SIZE:
+        raise ValueError(f"buffer_size must be >= {_SNIFF_SIZE}.")
 
     redirected_url = None
+    get = requests.get if session is None else session.get
+    parser = _create_parser()
 
     try:
-        with requests.get(url, timeout=timeout, stream=True) as data:
+        with get(
+            url,
+            headers={"Range": _HEAD_RANGE},
+            timeout=timeout,
+            stream=True,
+        ) as data:
+            if data.status_code == 416:
+                # Range Not Satisfiable, the page is empty.
+                return (parser, redirected_url)
             data.raise_for_status()
 
             # Overwrite the url with the redirected one.
             if data.url != url:
                 redirected_url = website_url(data.url)
 
-            data_iter = data.iter_content(buffer_size, decode_unicode=True)
+            data_iter = data.iter_content(buffer_size)
 
             filetype, first_chunk = _get_remote_filetype(data, data_iter)
 
@@ -252,19 +598,29 @@ def _get_remote_file(
             if filetype is None:
                 return (None, redirected_url)
 
-            # Using startswith just to be sure. MIME can sometimes append some
-            # data to the MIME string. This might not be necessary.
+            # Using startswith just to be sure. MIME can sometimes append
+            # some data to the MIME string. This might not be necessary.
             if not filetype.startswith(
                 "application/xhtml+xml"
             ) and not filetype.startswith("text/html"):
                 return (None, redirected_url)
 
+            chunks: Iterable[bytes] = data_iter
             if first_chunk is not None:
-                parser.feed(first_chunk)
-
-            for chunk in data_iter:
-                # Beware, chunk can sometimes be a bytes object.
-                parser.feed(str(chunk))
+                chunks = itertools.chain((first_chunk,), data_iter)
+            page = _iter_page(
+                chunks,
+                _is_partial(data),
+                parser,
+                website_url(data.url),
+                timeout,
+                buffer_size,
+                get,
+            )
+            # Leaving the with block closes the connections without
+            # downloading the rest of the page.
+            with contextlib.closing(page):
+                _feed_parser(parser, page, data.encoding)
     except requests.Timeout as exc:
         raise TimedOutError(f"Request to '{url}' timed out.") from exc
     except _StopSearch:
@@ -282,12 +638,16 @@ class _ResourceFaviconData(typing.NamedTuple):
     The resource can be local and remote.
     """
 
-    parser: _IconHTMLParser | None
+    parser: _IconParser | None
     new_url: website_url | None
 
 
 def _get_favicon_data(
-    is_local: bool, url: str, buffer_size: int, timeout: float | None
+    is_local: bool,
+    url: str,
+    buffer_size: int,
+    timeout: float | None,
+    session: requests.Session | None = None,
 ) -> _ResourceFaviconData:
     """Query local or remote web page for favicon URLs and their attributes.
 
@@ -296,13 +656,14 @@ def _get_favicon_data(
         url: URL of resource if it is remote, path to resource if it is local.
         buffer_size: Size of buffer.
         timeout: Timeout of request. Can be set to None to disable timeout.
+        session: Session used for remote requests or None.
 
     Raises:
         _RetrievalError: If web page file couldn't be accessed.
 
     Returns:
         _ResourceFaviconData containing information about the resource. Its
-        parser contains the _IconHTMLParser containing all favicon URLs and
+        parser contains the parser containing all favicon URLs and
         their attributes or None if the resource isn't (X)HTML. Its new_url
         contains a redirected url to the original website if reirection occured
         or None otherwise.
@@ -313,7 +674,9 @@ def _get_favicon_data(
     if is_local:
         parser = _get_local_file(url, buffer_size)
     else:
-        parser, link = _get_remote_file(website_url(url), timeout, buffer_size)
+        parser, link = _get_remote_file(
+            website_url(url), timeout, buffer_size, session
+        )
     if parser is None:
         # Not (X)HTML.
         return _ResourceFaviconData(None, link)
@@ -378,7 +741,9 @@ def _get_absolute_link(
 
 
 def get_favicon_url(
-    url: website_url, timeout: float | None
+    url: website_url,
+    timeout: float | None,
+    session: requests.Session | None = None,
 ) -> favicon_url | None:
     """Get an URL pointing to link's favicon.
 
@@ -391,6 +756,9 @@ def get_favicon_url(
           (http://, https://).
         timeout: Timeout of remote requests. Can be set to None to disable
           timeout.
+        session: Session used for remote requests. Reusing a session (see
+          create_session()) keeps connections alive between calls. A new
+          connection is made for every request if None.
 
     Raises:
         UnknownSchemeError: If link's scheme is not recognised.
@@ -400,7 +768,7 @@ def get_favicon_url(
         favicon_url of url or None if it couldn't be located.
     """
 
-    buffer_size = 2048
+    buffer_size = 65536
 
     _log.info("Processing link '%s'.", url)
     url_parsed = urllib.parse.urlparse(url)
@@ -420,7 +788,11 @@ def get_favicon_url(
     # succeeded and found no favicons, try /favicon.ico.
     try:
         response = _get_favicon_data(
-            is_local, url_parsed.path if is_local else url, buffer_size, timeout
+            is_local,
+            url_parsed.path if is_local else url,
+            buffer_size,
+            timeout,
+            session,
         )
     except _RetrievalError as exc:
         _log.info("%s", str(exc))
@@ -456,3 +828,91 @@ def get_favicon_url(
 
     _log.info("Found favicon '%s'.", result_link)
     return result_link
+
+
+def get_origin(url: website_url) -> website_url:
+    """Return the root URL of url's origin (scheme and host).
+
+    Local URLs are returned unchanged because local files have no meaningful
+    origin.
+
+    Args:
+        url: An URL of the resource.
+
+    Returns:
+        An URL like https://example.com/ for remote URLs, url otherwise.
+    """
+
+    url_parsed = urllib.parse.urlsplit(url)
+    if url_parsed.scheme not in ("http", "https"):
+        return url
+    return website_url(
+        urllib.parse.urlunsplit(
+            (url_parsed.scheme, url_parsed.netloc, "/", "", "")
+        )
+    )
+
+
+def create_session(pool_size: int) -> requests.Session:
+    """Create a session which can be shared between threads.
+
+    Args:
+        pool_size: Maximum number of connections kept alive per host. This
+          should match the number of threads using the session.
+
+    Returns:
+        A new session. The caller is responsible for closing it.
+    """
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_favicon_urls(
+    urls: Iterable[website_url],
+    timeout: float | None,
+    max_workers: int = 32,
+    session: requests.Session | None = None,
+) -> Iterator[tuple[website_url, concurrent.futures.Future]]:
+    """Get favicon URLs of many links concurrently.
+
+    All requests share a single session with a connection pool.
+
+    Args:
+        urls: URLs of the resources. See get_favicon_url().
+        timeout: Timeout of remote requests. Can be set to None to disable
+          timeout.
+        max_workers: Maximum number of concurrent requests.
+        session: Session used for remote requests. Its connection pool should
+          be large enough for max_workers threads (see create_session()). A
+          new session is created and closed afterwards if None.
+
+    Yields:
+        Tuples of URL and its finished future in the order of completion. The
+        future's result() returns what get_favicon_url() would return or
+        raises what get_favicon_url() would raise.
+    """
+
+    if session is None:
+        with create_session(max_workers) as session:
+            yield from get_favicon_urls(urls, timeout, max_workers, session)
+        return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = {
+            executor.submit(get_favicon_url, url, timeout, session): url
+            for url in urls
+        }
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                yield (futures[future], future)
+        except BaseException:
+            # Don't wait for all the queued requests on KeyboardInterrupt or
+            # when the generator is closed early.
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
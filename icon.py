@@ -5,6 +5,15 @@ import PIL
 import PIL.IcoImagePlugin
 from cairosvg import svg2png
 import io
+import struct
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# ICO header (reserved, type, number of images) and a directory entry (width,
+# height, number of colors, reserved, color planes, bits per pixel, size of the
+# image data, offset of the image data).
+_ICO_HEADER = struct.Struct("<HHH")
+_ICO_ENTRY = struct.Struct("<BBBBHHII")
 
 # Some helper functions.
 
@@ -15,11 +24,16 @@ class UnidentifiedImageError(Exception):
     pass
 
 
-def _bytes_to_image(image: bytes) -> Image.Image:
+def _bytes_to_image(
+    image: bytes, draft_size: tuple[int, int] | None = None
+) -> Image.Image:
     """Open a PIL Image with image data.
 
     Args:
         image: The image data.
+        draft_size: If set, let the decoder decode the image at a reduced scale
+          which is still at least this large. This is supported only by some
+          formats (JPEG), it's ignored otherwise.
 
     Returns:
         A PIL.Image.Image instance.
@@ -30,6 +44,8 @@ def _bytes_to_image(image: bytes) -> Image.Image:
             result = Image.open(image_data)
         except PIL.UnidentifiedImageError as exc:
             raise UnidentifiedImageError("Coudln't identify image") from exc
+        if draft_size is not None:
+            result.draft(None, draft_size)
         result.load()
         return result
 
@@ -52,6 +68,61 @@ def _image_to_bytes(image: Image.Image, format: str = "png") -> bytes:
         return image_data.getvalue()
 
 
+def _ico_frame_to_bytes(
+    ico: bytes, images: PIL.IcoImagePlugin.IcoFile, size: tuple[int, int]
+) -> bytes:
+    """Get a frame of ICO image as PNG.
+
+    Modern ICO files often store their frames as PNG images. These are returned
+    verbatim without decoding and encoding them again. Other frames are
+    converted to PNG.
+
+    The ICO directory is read directly, PIL doesn't provide a stable way to
+    get the location of a frame.
+
+    Args:
+        ico: The ICO image.
+        images: The parsed ICO image.
+        size: Size of the frame. It must be present in images.
+
+    Returns:
+        A PNG image saved in bytes object.
+    """
+
+    # Find the frame with the most bits per pixel like PIL does.
+    best: tuple[int, int, int] | None = None
+    try:
+        count = _ICO_HEADER.unpack_from(ico)[2]
+        for i in range(count):
+            width, height, _, _, _, bpp, length, offset = (
+                _ICO_ENTRY.unpack_from(
+                    ico, _ICO_HEADER.size + i * _ICO_ENTRY.size
+                )
+            )
+            # 0 means 256 pixels.
+            if (width or 256, height or 256) == size and (
+                best is None or bpp > best[0]
+            ):
+                best = (bpp, offset, length)
+    except struct.error:
+        best = None
+
+    if best is not None:
+        _, offset, length = best
+        frame = ico[offset : offset + length]
+
+        # The size in the ICO directory doesn't have to match the size of the
+        # embedded PNG, check the PNG's IHDR chunk too.
+        if (
+            len(frame) == length
+            and frame.startswith(_PNG_SIGNATURE)
+            and frame[12:16] == b"IHDR"
+            and struct.unpack(">II", frame[16:24]) == size
+        ):
+            return frame
+    return _image_to_bytes(images.getimage(size))
+
+
 class IconPair:
     """This class represents 16x16 and 32x32 PNG images suitable as favicons.
 
@@ -94,10 +165,12 @@ class IconPair:
             A IconPair object.
         """
 
-        image = _bytes_to_image(img)
-        x16 = _image_to_bytes(image.resize((16, 16)))
-        x32 = _image_to_bytes(image.resize((32, 32)))
-        return cls(x16, x32)
+        image = _bytes_to_image(img, (32, 32))
+        # Bilinear filtering is good enough for images this small. The 16x16
+        # image is made from the already downscaled 32x32 one.
+        image32 = image.resize((32, 32), Image.Resampling.BILINEAR)
+        image16 = image32.resize((16, 16), Image.Resampling.BILINEAR)
+        return cls(_image_to_bytes(image16), _image_to_bytes(image32))
 
     @classmethod
     def create_from_svg(cls, svg: bytes) -> "IconPair":
@@ -109,6 +182,7 @@ class IconPair:
         Returns:
             A IconPair object.
         """
+
         x16 = svg2png(svg, output_width=16, output_height=16)
         x32 = svg2png(svg, output_width=32, output_height=32)
         assert isinstance(x16, bytes)
@@ -138,13 +212,17 @@ class IconPair:
             # Try to use the right sized icon when available, otherwise
             # downscale (or upscale).
             if (32, 32) in sizes:
-                x32 = _image_to_bytes(images.getimage((32, 32)))
+                x32 = _ico_frame_to_bytes(ico, images, (32, 32))
             else:
-                x32 = _image_to_bytes(largest.resize((32, 32)))
+                x32 = _image_to_bytes(
+                    largest.resize((32, 32), Image.Resampling.BILINEAR)
+                )
 
             if (16, 16) in sizes:
-                x16 = _image_to_bytes(images.getimage((16, 16)))
+                x16 = _ico_frame_to_bytes(ico, images, (16, 16))
             else:
-                x16 = _image_to_bytes(largest.resize((16, 16)))
+                x16 = _image_to_bytes(
+                    largest.resize((16, 16), Image.Resampling.BILINEAR)
+                )
 
         return cls(x16, x32)
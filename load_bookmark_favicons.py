@@ -15,17 +15,28 @@ import sys
 import os
 import requests
 import urllib.parse
-from collections.abc import Iterable
+from collections.abc import Collection, Iterable, Iterator
 import contextlib
+import concurrent.futures
+import multiprocessing
+import sqlite3
+import functools
 
 import magic
 
 import bookmarks
 import dbinterface
+import dead_links
 import get_favicon_url
 import icon
 from base_types import *
 
+# Default number of concurrent requests.
+_MAX_WORKERS = 32
+
+# Favicons larger than this (in bytes) are skipped.
+_MAX_FAVICON_SIZE = 1024 * 1024
+
 
 class NullStream:
     """Helper class to provide a null stream."""
@@ -34,146 +45,417 @@ class NullStream:
         pass
 
 
-def query_favicons(
-    bookmarks: Iterable[website_url], timeout: float | None, interactive: bool
-) -> dict[website_url, favicon_url]:
-    """Try to query all favicon URLs with a nice progress bar.
+def _query_favicon_urls(
+    urls: Collection[website_url],
+    timeout: float | None,
+    interactive: bool,
+    session: requests.Session,
+    max_workers: int,
+    description: str,
+) -> dict[website_url, favicon_url | None]:
+    """Query favicon URLs of urls concurrently with a nice progress bar.
 
     Args:
-        bookmarks: List of links to retrieve favicon URLs for.
+        urls: Links to retrieve favicon URLs for.
         timeout: Request timeout.
         interactive: If True use tqdm.
+        session: Session used for remote requests.
+        max_workers: Maximum number of concurrent requests.
+        description: Description of the progress bar.
 
     Returns:
-        A dictionary whose keys are bookmarks and whose values are their
-        favicon links and their type.
+        A dictionary whose keys are links and whose values are their favicon
+        links or None if the link doesn't have any. Links which couldn't be
+        queried are left out.
     """
 
-    result = {}
-    iterator: Iterable[website_url] | tqdm.tqdm[website_url]
-    log: tqdm.tqdm[website_url] | NullStream
+    result: dict[website_url, favicon_url | None] = {}
+    completed = get_favicon_url.get_favicon_urls(
+        urls, timeout, max_workers, session
+    )
+    iterator: Iterable[tuple[website_url, concurrent.futures.Future]]
+    log: tqdm.tqdm | NullStream
     if interactive:
-        iterator = tqdm.tqdm(bookmarks, "Querying favicons")
+        iterator = tqdm.tqdm(completed, description, total=len(urls))
         log = iterator
     else:
-        iterator = bookmarks
+        iterator = completed
         log = NullStream()
 
-    for link in iterator:
+    for link, future in iterator:
         try:
-            favicon = get_favicon_url.get_favicon_url(link, timeout)
+            result[link] = future.result()
         except get_favicon_url.UnknownSchemeError:
             log.write(f"warning: {link}: Unknown scheme, skipping...")
         except get_favicon_url.TimedOutError:
             log.write(f"warning: {link}: Timed out, skipping...")
         else:
-            if favicon is None:
-                log.write(f"info: {link}: No favicon found, skipping...")
-            else:
+            if result[link] is None:
+                log.write(f"info: {link}: No favicon found")
+    return result
+
+
+def query_favicons(
+    bookmarks: Collection[website_url],
+    timeout: float | None,
+    interactive: bool,
+    session: requests.Session,
+    per_url: bool = False,
+    max_workers: int = _MAX_WORKERS,
+) -> dict[website_url, favicon_url]:
+    """Try to query all favicon URLs with a nice progress bar.
+
+    The links are queried concurrently. Unless per_url is set, the favicon is
+    queried only once per website (the root page of the origin) and it's
+    shared by all its bookmarks. If the root page doesn't have a favicon of
+    its own (get_favicon_url() returned nothing or just guessed
+    /favicon.ico), the bookmarks of the website are queried separately.
+
+    Args:
+        bookmarks: List of links to retrieve favicon URLs for.
+        timeout: Request timeout.
+        interactive: If True use tqdm.
+        session: Session used for remote requests.
+        per_url: If True query the favicon of every link separately.
+        max_workers: Maximum number of concurrent requests.
+
+    Returns:
+        A dictionary whose keys are bookmarks and whose values are their
+        favicon links and their type.
+    """
+
+    # Links grouped by the URL which is queried for them.
+    groups: dict[website_url, list[website_url]] = {}
+    for link in bookmarks:
+        query = link if per_url else get_favicon_url.get_origin(link)
+        groups.setdefault(query, []).append(link)
+
+    result = {}
+    # Bookmarks whose website's root page has no favicon of its own. Websites
+    # which timed out aren't queried again, their pages would most likely time
+    # out too. A page which links /favicon.ico explicitly is queried again as
+    # well, this only costs a few requests.
+    fallback = []
+    found = _query_favicon_urls(
+        groups, timeout, interactive, session, max_workers, "Querying favicons"
+    )
+    for query, favicon in found.items():
+        if favicon is None or (
+            urllib.parse.urlsplit(favicon).path == "/favicon.ico"
+        ):
+            fallback.extend(link for link in groups[query] if link != query)
+        if favicon is not None:
+            # The guessed favicon is used unless a page has its own one.
+            for link in groups[query]:
+                result[link] = favicon
+
+    if fallback:
+        found = _query_favicon_urls(
+            fallback,
+            timeout,
+            interactive,
+            session,
+            max_workers,
+            "Querying favicons of pages",
+        )
+        for link, favicon in found.items():
+            if favicon is not None:
                 result[link] = favicon
     return result
 
 
+# Favicon URL, the raw image and its MIME type declared by the server (None if
+# unknown).
+favicon_data_type = tuple[favicon_url, bytes, str | None]
+
+
+def _unique(iterable: Iterable) -> Iterator:
+    """Yield items of iterable without duplicates (keeping their order)."""
+
+    seen = set()
+    for item in iterable:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
+
+class _FetchError(Exception):
+    """Raised when a favicon couldn't be fetched."""
+
+
+def _fetch_favicon(
+    link: favicon_url, timeout: float | None, session: requests.Session
+) -> tuple[bytes, str | None]:
+    """Fetch a single local or remote favicon.
+
+    Args:
+        link: The favicon URL.
+        timeout: Request timeout.
+        session: Session used for remote requests.
+
+    Raises:
+        _FetchError: If the favicon couldn't be fetched. The message describes
+          the reason.
+
+    Returns:
+        The raw favicon image and its MIME type from Content-Type (None for
+        local favicons and if the server didn't send it).
+    """
+
+    # Checking the prefix is enough to tell local favicons apart, only they
+    # need to be parsed.
+    if link.startswith("file:"):
+        try:
+            with open(urllib.parse.urlparse(link).path, "rb") as f:
+                return (f.read(), None)
+        except OSError as exc:
+            raise _FetchError("Couldn't access file") from exc
+
+    try:
+        with session.get(
+            link,
+            timeout=timeout,
+            stream=True,
+            headers={"Accept": "image/*,*/*;q=0.8"},
+        ) as req:
+            req.raise_for_status()
+
+            content_length = req.headers.get("Content-Length", "")
+            if content_length.isdigit() and (
+                int(content_length) > _MAX_FAVICON_SIZE
+            ):
+                raise _FetchError("Favicon is too large")
+
+            # Don't let a misbehaving server make us download a huge file.
+            image = bytearray()
+            for chunk in req.iter_content(65536):
+                image += chunk
+                if len(image) > _MAX_FAVICON_SIZE:
+                    raise _FetchError("Favicon is too large")
+
+            # MIME type might contain additional information after ;.
+            content_type = req.headers.get("Content-Type")
+            if content_type is not None:
+                content_type = content_type.split(";", 1)[0].strip().lower()
+            return (bytes(image), content_type)
+    except requests.Timeout as exc:
+        raise _FetchError("Request timed out") from exc
+    except (requests.ConnectionError, requests.HTTPError) as exc:
+        raise _FetchError("Request failed") from exc
+
+
 def fetch_favicons(
-    favicons: Iterable[favicon_url], timeout: float | None, interactive: bool
-) -> list[tuple[favicon_url, bytes]]:
+    favicons: Iterable[favicon_url],
+    timeout: float | None,
+    interactive: bool,
+    session: requests.Session,
+    max_workers: int = _MAX_WORKERS,
+) -> list[favicon_data_type]:
     """Fetch favicons with a nice progress bar.
 
+    The favicons are fetched concurrently. Each favicon is submitted as soon
+    as favicons yields it.
+
     Args:
         favicons: An iterable of favicon URLs to try to fetch.
         timeout: Request timeout.
         interactive: If True use tqdm.
+        session: Session used for remote requests.
+        max_workers: Maximum number of concurrent requests.
 
     Returns:
-        It returns favicon URLs with their favicon. Not all favicons have to
+        It returns favicon URLs with their favicon and its MIME type (if the
+        server declared it). Not all favicons have to
         be processed. The returned list can be shorter than the input iterable.
         This is mainly caused by trying to download nonexistant favicons.
     """
 
     result = []
-    iterator: Iterable[favicon_url] | tqdm.tqdm[favicon_url]
-    log: tqdm.tqdm[favicon_url] | NullStream
-    if interactive:
-        iterator = tqdm.tqdm(favicons, "Fetching favicons")
-        log = iterator
-    else:
-        iterator = favicons
-        log = NullStream()
-
-    for link in iterator:
-        url = urllib.parse.urlparse(link)
-        if url.scheme == "file":
-            try:
-                with open(url.path, "rb") as f:
-                    image = f.read()
-            except OSError:
-                log.write(f"info: {link}: Couldn't access file, skipping...")
-            else:
-                result.append((link, image))
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        futures = {
+            executor.submit(_fetch_favicon, link, timeout, session): link
+            for link in favicons
+        }
+        completed = concurrent.futures.as_completed(futures)
+        iterator: Iterable[concurrent.futures.Future] | tqdm.tqdm
+        log: tqdm.tqdm | NullStream
+        if interactive:
+            iterator = tqdm.tqdm(
+                completed, "Fetching favicons", total=len(futures)
+            )
+            log = iterator
         else:
-            try:
-                with requests.get(link, timeout=timeout) as req:
-                    req.raise_for_status()
-                    image = req.content
-            except requests.Timeout:
-                log.write(f"info: {link}: Request timed out, skipping...")
-            except (requests.ConnectionError, requests.HTTPError):
-                log.write(f"info: {link}: Request failed, skipping...")
-            else:
-                result.append((link, image))
+            iterator = completed
+            log = NullStream()
+
+        try:
+            for future in iterator:
+                link = futures[future]
+                try:
+                    image, content_type = future.result()
+                except _FetchError as exc:
+                    log.write(f"info: {link}: {exc}, skipping...")
+                else:
+                    result.append((link, image, content_type))
+        except BaseException:
+            # Don't wait for all the queued fetches on KeyboardInterrupt or
+            # on an unexpected error.
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
     return result
 
 
-favicon_data_type = tuple[favicon_url, bytes]
+_ICO_SIGNATURE = b"\x00\x00\x01\x00"
+
+
+def _guess_image_type(raw_image: bytes) -> str | None:
+    """Guess the type of favicon from its first bytes.
+
+    Only ICO and SVG images need to be recognised, PIL identifies other
+    formats itself.
+
+    Args:
+        raw_image: The image.
+
+    Returns:
+        "ico", "svg" or None for other images.
+    """
+
+    if raw_image.startswith(_ICO_SIGNATURE):
+        return "ico"
+
+    head = raw_image[:1024].removeprefix(b"\xef\xbb\xbf").lstrip()
+    if head.startswith(b"<svg") or (
+        head.startswith(b"<?xml") and b"<svg" in head
+    ):
+        return "svg"
+    return None
+
+
+@functools.cache
+def _get_magic() -> magic.Magic:
+    """Return a magic.Magic instance detecting MIME types.
+
+    magic.from_buffer() sets up libmagic on every call. The instance is
+    created lazily so every conversion process gets its own one.
+    """
+
+    return magic.Magic(mime=True)
+
+
+def _convert_favicon(
+    raw_image: bytes, content_type: str | None = None
+) -> icon.IconPair:
+    """Convert a raw favicon image of any supported type to icon.IconPair.
+
+    Args:
+        raw_image: The image.
+        content_type: MIME type of the image declared by the server or None.
+          It's used only when the image can't be identified from its content.
+
+    Raises:
+        icon.UnidentifiedImageError: If the image couldn't be identified.
+
+    Returns:
+        The converted image.
+    """
+
+    match _guess_image_type(raw_image):
+        case "ico":
+            return icon.IconPair.create_from_ico(raw_image)
+        case "svg":
+            return icon.IconPair.create_from_svg(raw_image)
+
+    try:
+        return icon.IconPair.create_from_image(raw_image)
+    except icon.UnidentifiedImageError:
+        # The check above can miss some unusual SVG images (an SVG starting
+        # with a comment for example). Trust the server in that case.
+        if content_type == "image/svg+xml":
+            return icon.IconPair.create_from_svg(raw_image)
+
+        # Otherwise let magic have a look at it. MIME type might contain
+        # additional information after ;.
+        filetype = _get_magic().from_buffer(raw_image).split(";", 1)[0]
+        match filetype:
+            case "image/vnd.microsoft.icon" | "image/x-icon":
+                return icon.IconPair.create_from_ico(raw_image)
+            case "image/svg+xml":
+                return icon.IconPair.create_from_svg(raw_image)
+        raise
 
 
 def convert_favicon_images(
-    favicons: Iterable[favicon_data_type], interactive: bool
+    favicons: Collection[favicon_data_type], interactive: bool
 ) -> list[tuple[favicon_url, icon.IconPair]]:
     """Convert all raw favicon images to icon.IconPair
 
+    The images are converted in parallel by a pool of processes. Identical
+    images (served from different favicon URLs) are converted only once.
+
     Args:
-        favicons: Dict of website links, favicon links and the raw images.
+        favicons: Favicon links with their raw images and MIME types.
         interactive: If True use tqdm.
 
     Returns:
         A copy of favicons iterable with bytes converted to icon.IconPair.
     """
 
-    result = []
-    iterator: Iterable[favicon_data_type] | tqdm.tqdm[favicon_data_type]
-    log: tqdm.tqdm[favicon_data_type] | NullStream
-    if interactive:
-        iterator = tqdm.tqdm(favicons, "Converting favicons")
-        log = iterator
-    else:
-        iterator = favicons
-        log = NullStream()
+    result: list[tuple[favicon_url, icon.IconPair]] = []
+    if not favicons:
+        return result
+
+    # forkserver is cheaper than spawn and safer than fork (the main process
+    # runs threads). It isn't available on Windows.
+    mp_context = None
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context("forkserver")
+
+    with concurrent.futures.ProcessPoolExecutor(
+        mp_context=mp_context
+    ) as executor:
+        # Favicon URLs grouped by their image. The first declared MIME type is
+        # used for the whole group.
+        links: dict[bytes, tuple[str | None, list[favicon_url]]] = {}
+        for website, raw_image, content_type in favicons:
+            links.setdefault(raw_image, (content_type, []))[1].append(website)
+
+        futures = {
+            executor.submit(
+                _convert_favicon, raw_image, content_type
+            ): websites
+            for raw_image, (content_type, websites) in links.items()
+        }
+        completed = concurrent.futures.as_completed(futures)
+        iterator: Iterable[concurrent.futures.Future] | tqdm.tqdm
+        log: tqdm.tqdm | NullStream
+        if interactive:
+            iterator = tqdm.tqdm(
+                completed, "Converting favicons", total=len(futures)
+            )
+            log = iterator
+        else:
+            iterator = completed
+            log = NullStream()
 
-    for website, raw_image in favicons:
-        filetype = magic.from_buffer(raw_image, True)
-        # MIME type might contain additional information after ;. This check
-        # might not be necessary. Checking if favicon_url ends in .ico is
-        # possible but using magic should be bullet proof.
-        filetype = filetype.split(";", 1)[0]
         try:
-            match filetype:
-                case "image/vnd.microsoft.icon" | "image/x-icon":
-                    result.append(
-                        (website, icon.IconPair.create_from_ico(raw_image))
-                    )
-                case "image/svg+xml":
-                    result.append(
-                        (website, icon.IconPair.create_from_svg(raw_image))
-                    )
-                case _:
-                    result.append(
-                        (website, icon.IconPair.create_from_image(raw_image))
-                    )
-        except icon.UnidentifiedImageError:
-            log.write(
-                f"warning: {website}: Couldn't identify image, skipping..."
-            )
+            for future in iterator:
+                websites = futures[future]
+                try:
+                    converted = future.result()
+                except icon.UnidentifiedImageError:
+                    for website in websites:
+                        log.write(
+                            f"warning: {website}: Couldn't identify image, "
+                            "skipping..."
+                        )
+                else:
+                    result.extend((website, converted) for website in websites)
+        except BaseException:
+            # Don't wait for all the queued conversions on KeyboardInterrupt or
+            # on an unexpected error.
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
     return result
 
 
@@ -233,9 +515,37 @@ def main():
         "timeout. (default: %(default)s)",
         default=10,
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="Number of concurrent requests. (default: %(default)s)",
+        default=_MAX_WORKERS,
+    )
+    parser.add_argument(
+        "--per-url",
+        action="store_true",
+        help="Query the favicon of every bookmark separately instead of once "
+        "per website",
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="FILE",
+        help="Remember bookmarks whose favicon couldn't be found in FILE and "
+        "don't query them again for a while",
+    )
+    parser.add_argument(
+        "--retry-dead",
+        action="store_true",
+        help="Query bookmarks remembered in the --cache file anyway",
+    )
     parser.add_argument("BOOKMARKS_FILE", help="Path to the Bookmarks file.")
     parser.add_argument("FAVICONS_FILE", help="Path to the Favicons file.")
     args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("argument -j/--jobs: must be at least 1")
+    if args.retry_dead and not args.cache:
+        parser.error("argument --retry-dead: requires --cache")
 
     if not os.access(args.BOOKMARKS_FILE, os.F_OK):
         print(
@@ -256,8 +566,9 @@ def main():
     loggers = setup_logging(args.verbose)
 
     try:
-        with open(args.BOOKMARKS_FILE) as f:
-            bookmark_links = bookmarks.get_all_bookmarks(f)
+        bookmark_links = set(
+            bookmarks.iter_all_bookmarks_from_path(args.BOOKMARKS_FILE)
+        )
     except OSError:
         print(
             f"Couldn't access bookmarks file '{args.BOOKMARKS_FILE}'!",
@@ -272,19 +583,44 @@ def main():
         )
         sys.exit(1)
 
+    cache: dead_links.DeadLinkCache | None = None
+    if args.cache:
+        try:
+            cache = dead_links.DeadLinkCache(args.cache)
+        except sqlite3.Error:
+            print(
+                f"Couldn't open cache file '{args.cache}'!",
+                file=sys.stderr,
+            )
+            sys.exit(1)
+
     try:
         with dbinterface.DBInterface(
             args.FAVICONS_FILE
-        ) as db, tqdm.contrib.logging.logging_redirect_tqdm(
+        ) as db, get_favicon_url.create_session(
+            args.jobs
+        ) as session, (
+            cache if cache is not None else contextlib.nullcontext()
+        ), tqdm.contrib.logging.logging_redirect_tqdm(
             loggers
         ) if interactive else contextlib.nullcontext():
             # These are all website URLs that aren't already in db.
-            filtered_bookmarks = set(bookmark_links) - db.get_icon_mappings()
+            filtered_bookmarks = db.get_unmapped_urls(bookmark_links)
+            if cache is not None and not args.retry_dead:
+                filtered_bookmarks = cache.filter_dead(filtered_bookmarks)
 
             # This dict maps website URL to its favicon URL (and its type).
             favicon_mapping = query_favicons(
-                filtered_bookmarks, timeout, interactive
+                filtered_bookmarks,
+                timeout,
+                interactive,
+                session,
+                args.per_url,
+                args.jobs,
             )
+            if cache is not None:
+                cache.add(filtered_bookmarks - favicon_mapping.keys())
+                cache.remove(favicon_mapping)
 
             # List of website URLs that aren't in the db.
             filtered_links = set(db.merge_existing_icons(favicon_mapping))
@@ -295,14 +631,17 @@ def main():
             }
 
             favicon_raw_images = fetch_favicons(
-                set(filtered_mapping.values()), timeout, interactive
+                _unique(filtered_mapping.values()),
+                timeout,
+                interactive,
+                session,
+                args.jobs,
             )
 
             favicon_images = convert_favicon_images(
                 favicon_raw_images, interactive
             )
-            db.add_new_icons(favicon_images)
-            db.merge_existing_icons(filtered_mapping)
+            db.add_icons_and_link(filtered_mapping, favicon_images)
     except dbinterface.LockedDatabaseError:
         print(
             "Couldn't access the database. load_bookmark_favicons can not run "
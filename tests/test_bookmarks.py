@@ -34,3 +34,49 @@ class BookmarksTest(unittest.TestCase):
                 bookmarks.get_all_bookmarks,
                 f,
             )
+
+    def test_bookmark_retrieve_from_path(self):
+        result = bookmarks.get_all_bookmarks_from_path(
+            "tests/sample-data/Bookmarks"
+        )
+        self.assertCountEqual(
+            result,
+            [
+                "https://twitter.com/",
+                "https://www.facebook.com/",
+                "https://github.com/",
+                "https://stackoverflow.com/",
+                "https://example.com/",
+            ],
+        )
+        self.assertRaises(
+            bookmarks.IncompatibleBookmarksError,
+            bookmarks.get_all_bookmarks_from_path,
+            "tests/sample-data/Bookmarks-new",
+        )
+        self.assertRaises(
+            bookmarks.IncompatibleBookmarksError,
+            bookmarks.iter_all_bookmarks_from_path,
+            "tests/sample-data/Bookmarks-new",
+        )
+
+    def test_bookmark_iterate(self):
+        with open("tests/sample-data/Bookmarks") as f:
+            result = bookmarks.iter_all_bookmarks(f)
+        self.assertCountEqual(
+            result,
+            [
+                "https://twitter.com/",
+                "https://www.facebook.com/",
+                "https://github.com/",
+                "https://stackoverflow.com/",
+                "https://example.com/",
+            ],
+        )
+        # The version must be checked eagerly, not on the first iteration.
+        with open("tests/sample-data/Bookmarks-new") as f:
+            self.assertRaises(
+                bookmarks.IncompatibleBookmarksError,
+                bookmarks.iter_all_bookmarks,
+                f,
+            )
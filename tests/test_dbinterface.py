@@ -1,5 +1,8 @@
 import unittest
 import sqlite3
+import tempfile
+import shutil
+import os.path
 
 import icon
 import dbinterface
@@ -21,6 +24,17 @@ class DBInterfaceTest(unittest.TestCase):
         )
         db.close()
 
+    def test_unmapped_urls(self):
+        db = dbinterface.DBInterface("tests/sample-data/Favicons")
+        urls = [
+            "https://github.com/",
+            "https://example.com/",
+            "https://example.com/",
+        ]
+        self.assertEqual(db.get_unmapped_urls(urls), {"https://example.com/"})
+        self.assertEqual(db.get_unmapped_urls([]), set())
+        db.close()
+
     def test_empty_database(self):
         db = dbinterface.DBInterface("tests/sample-data/Favicons-empty", True)
 
@@ -52,6 +66,28 @@ class DBInterfaceTest(unittest.TestCase):
         self.assertCountEqual(db.get_icon_mappings(), ["https://facebook.com/"])
         db.close()
 
+    def test_adding_and_linking_icons(self):
+        db = dbinterface.DBInterface("tests/sample-data/Favicons-empty", True)
+
+        new_mappings = {
+            "https://facebook.com/": "https://static.xx.fbcdn.net/rsrc.php/yb/r/hLRJ1GG_y0J.ico",
+            "https://www.youtube.com/": "https://www.youtube.com/s/desktop/b95ddd88/img/favicon_32x32.png",
+        }
+        x16 = get_icon("tests/sample-data/facebook16.png")
+        x32 = get_icon("tests/sample-data/facebook32.png")
+
+        db.add_icons_and_link(
+            new_mappings,
+            [
+                (
+                    "https://static.xx.fbcdn.net/rsrc.php/yb/r/hLRJ1GG_y0J.ico",
+                    icon.IconPair(x16, x32),
+                )
+            ],
+        )
+        self.assertCountEqual(db.get_icon_mappings(), ["https://facebook.com/"])
+        db.close()
+
     def test_merging_icons(self):
         db = dbinterface.DBInterface("tests/sample-data/Favicons", True)
         # Add some nonexisting icons and newgithub.com which has the same icon
@@ -218,3 +254,42 @@ class DBInterfaceTest(unittest.TestCase):
             ],
         )
         db.close()
+
+    def test_adding_icons_from_generator(self):
+        db = dbinterface.DBInterface("tests/sample-data/Favicons", True)
+
+        x16 = get_icon("tests/sample-data/facebook16.png")
+        x32 = get_icon("tests/sample-data/facebook32.png")
+
+        new_icon = icon.IconPair(x16, x32)
+        new_mappings = {
+            "https://facebook.com/": "https://static.xx.fbcdn.net/rsrc.php/yb/r/hLRJ1GG_y0J.ico"
+        }
+
+        db.add_new_icons(
+            (favicon, new_icon) for favicon in new_mappings.values()
+        )
+        # All icons from the generator must have been added.
+        self.assertEqual(db.merge_existing_icons(new_mappings), [])
+        db.close()
+
+    def test_rollback_on_exception(self):
+        # Changes made before an exception mustn't be saved.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "Favicons")
+            shutil.copyfile("tests/sample-data/Favicons", path)
+
+            new_mappings = {
+                "https://newgithub.com/": "https://github.githubassets.com/favicons/favicon-dark.svg",
+            }
+            with self.assertRaises(KeyboardInterrupt):
+                with dbinterface.DBInterface(path) as db:
+                    self.assertEqual(db.merge_existing_icons(new_mappings), [])
+                    raise KeyboardInterrupt
+
+            db = dbinterface.DBInterface(path)
+            self.assertCountEqual(
+                db.get_icon_mappings(),
+                ["https://github.com/", "https://stackoverflow.com/"],
+            )
+            db.close()
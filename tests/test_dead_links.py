@@ -0,0 +1,57 @@
+import unittest
+import tempfile
+import os.path
+
+import dead_links
+
+
+class DeadLinkCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, "cache")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_backoff(self):
+        urls = {"https://example.com/", "https://example.org/"}
+        with dead_links.DeadLinkCache(self.path) as cache:
+            cache.add(["https://example.com/"], now=0)
+            self.assertEqual(
+                cache.filter_dead(urls, now=1), {"https://example.org/"}
+            )
+            self.assertEqual(
+                cache.filter_dead(urls, now=dead_links._BASE_DELAY), urls
+            )
+
+            # The second failure doubles the delay.
+            cache.add(["https://example.com/"], now=dead_links._BASE_DELAY)
+            self.assertEqual(
+                cache.filter_dead(urls, now=dead_links._BASE_DELAY * 2),
+                {"https://example.org/"},
+            )
+            self.assertEqual(
+                cache.filter_dead(urls, now=dead_links._BASE_DELAY * 3), urls
+            )
+
+    def test_persistence_and_removal(self):
+        urls = ["https://example.com/"]
+        with dead_links.DeadLinkCache(self.path) as cache:
+            cache.add(urls, now=0)
+
+        with dead_links.DeadLinkCache(self.path) as cache:
+            self.assertEqual(cache.filter_dead(urls, now=1), set())
+            cache.remove(urls)
+            self.assertEqual(cache.filter_dead(urls, now=1), set(urls))
+
+    def test_max_delay(self):
+        urls = ["https://example.com/"]
+        with dead_links.DeadLinkCache(self.path) as cache:
+            for _ in range(100):
+                cache.add(urls, now=0)
+            self.assertEqual(
+                cache.filter_dead(urls, now=dead_links._MAX_DELAY - 1), set()
+            )
+            self.assertEqual(
+                cache.filter_dead(urls, now=dead_links._MAX_DELAY), set(urls)
+            )
@@ -1,5 +1,9 @@
 import unittest
+import unittest.mock
 import os.path
+import io
+import re
+import types
 import requests
 
 import get_favicon_url
@@ -11,6 +15,39 @@ def get_file_url(path: str) -> str:
     return "file://" + os.path.abspath(path)
 
 
+def fake_session(
+    body: bytes, honor_continuation: bool = True
+) -> tuple[types.SimpleNamespace, list[str | None]]:
+    """Create a fake session serving body which supports the Range header.
+
+    Returns:
+        The session and a list to which the requested ranges are appended.
+    """
+
+    requested: list[str | None] = []
+
+    def get(url, headers, timeout, stream):
+        requested.append(headers.get("Range"))
+        response = requests.Response()
+        response.url = url
+        response.headers["Content-Type"] = "text/html; charset=utf-8"
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", headers.get("Range", ""))
+        if match and (match[1] == "0" or honor_continuation):
+            start = int(match[1])
+            end = min(int(match[2] or len(body) - 1), len(body) - 1)
+            response.status_code = 206
+            response.headers["Content-Range"] = (
+                f"bytes {start}-{end}/{len(body)}"
+            )
+            response.raw = io.BytesIO(body[start : end + 1])
+        else:
+            response.status_code = 200
+            response.raw = io.BytesIO(body)
+        return response
+
+    return (types.SimpleNamespace(get=get), requested)
+
+
 class GetFaviconUrlTest(unittest.TestCase):
     """Test various hand-picked websites and search for their favicon."""
 
@@ -94,3 +131,169 @@ class GetFaviconUrlTest(unittest.TestCase):
         # The request should be redirected to archive.kernel.org. The favicon
         # should be relative to the final link, not to the original link.
         self.assertNotEqual(result, "https://btrfs.wiki.kernel.org/favicon.ico")
+
+    def test_multiple_urls(self):
+        urls = [
+            get_file_url(f"tests/sample-data/website{website}/index.html")
+            for website in range(1, 6)
+        ]
+        results = {
+            url: future.result()
+            for url, future in get_favicon_url.get_favicon_urls(urls, None, 2)
+        }
+        self.assertEqual(
+            results,
+            {url: get_favicon_url.get_favicon_url(url, None) for url in urls},
+        )
+
+    def test_origin(self):
+        self.assertEqual(
+            get_favicon_url.get_origin("https://example.com/a/b?c=d#e"),
+            "https://example.com/",
+        )
+        self.assertEqual(
+            get_favicon_url.get_origin("http://example.com:8080"),
+            "http://example.com:8080/",
+        )
+        path = get_file_url("tests/sample-data/website1/index.html")
+        self.assertEqual(get_favicon_url.get_origin(path), path)
+
+
+class ParserTest(unittest.TestCase):
+    """Test that both HTML parsing backends produce the same results."""
+
+    def test_parsers_agree(self):
+        if get_favicon_url._lxml_etree is None:
+            self.skipTest("lxml isn't installed.")
+
+        documents = []
+        for website in range(1, 6):
+            with open(f"tests/sample-data/website{website}/index.html") as f:
+                documents.append(f.read())
+        # lxml ends head implicitly on these, the link must still be found.
+        for content in (
+            "text",
+            "<div></div>",
+            "<img src=x>",
+            "<iframe></iframe>",
+        ):
+            documents.append(
+                f"<html><head><title>x</title>{content}"
+                "<link rel=icon href=/a.ico></head>"
+                "<body><link rel=icon href=/b.ico></body></html>"
+            )
+
+        for document in documents:
+            with self.subTest(document=document[:120]):
+                parsers = (
+                    get_favicon_url._IconHTMLParser(),
+                    get_favicon_url._LxmlIconParser(),
+                )
+                for parser in parsers:
+                    try:
+                        parser.feed(document)
+                    except get_favicon_url._StopSearch:
+                        pass
+
+                self.assertEqual(parsers[0].favicons, parsers[1].favicons)
+                self.assertEqual(parsers[0].base_url, parsers[1].base_url)
+
+    def test_lxml_split_head_end(self):
+        if get_favicon_url._lxml_etree is None:
+            self.skipTest("lxml isn't installed.")
+
+        parser = get_favicon_url._LxmlIconParser()
+        parser.feed(b"<head><p>x</p><link rel=icon href=/a.ico></he")
+        with self.assertRaises(get_favicon_url._StopSearch):
+            parser.feed(b"ad><link rel=icon href=/b.ico>")
+        self.assertEqual(parser.favicons, [{"rel": "icon", "href": "/a.ico"}])
+
+    def test_decode_split_character(self):
+        encoded = "<link href='ľ.ico'>".encode()
+        # Split the two-byte character between chunks.
+        split = encoded.index(b"'") + 2
+        chunks = (encoded[:split], encoded[split:])
+        self.assertEqual(
+            "".join(get_favicon_url._decode_chunks(chunks, "utf-8")),
+            "<link href='ľ.ico'>",
+        )
+
+    def test_sniff_html(self):
+        sniff = get_favicon_url._sniff_html
+        self.assertEqual(sniff(b"\xef\xbb\xbf\n <!DOCTYPE html>"), "text/html")
+        self.assertEqual(sniff(b"<HTML lang='en'>"), "text/html")
+        self.assertEqual(sniff(b"<!-- comment -->"), "text/html")
+        self.assertEqual(sniff(b'<meta charset="utf-8">'), "text/html")
+        self.assertEqual(
+            sniff(b'<?xml version="1.0"?>\n<html xmlns="...">'),
+            "application/xhtml+xml",
+        )
+        self.assertIsNone(sniff(b'<?xml version="1.0"?>\n<svg>'))
+        self.assertIsNone(sniff(b"<abbr>"))
+        self.assertIsNone(sniff(b"\x89PNG\r\n\x1a\n"))
+        self.assertIsNone(sniff(b""))
+
+    def test_partial_response(self):
+        def response(status_code, content_range=None):
+            result = requests.Response()
+            result.status_code = status_code
+            if content_range is not None:
+                result.headers["Content-Range"] = content_range
+            return result
+
+        self.assertFalse(get_favicon_url._is_partial(response(200)))
+        self.assertTrue(
+            get_favicon_url._is_partial(response(206, "bytes 0-32767/40000"))
+        )
+        # The whole resource fits into the requested range.
+        self.assertFalse(
+            get_favicon_url._is_partial(response(206, "bytes 0-1233/1234"))
+        )
+
+    def test_range_requests(self):
+        early = b"<head><link rel=icon href=/e.ico><body>" + b"<p>x</p>" * 25000
+        late = (
+            b"<head>"
+            + b"<meta name=a content=b>" * 3000
+            + b"<link rel=icon href=/late.ico></head>"
+        )
+        cases = (
+            (early, True, "/e.ico", ["bytes=0-32767"]),
+            (late, True, "/late.ico", ["bytes=0-32767", "bytes=32768-"]),
+            (late, False, "/late.ico", ["bytes=0-32767", "bytes=32768-"]),
+        )
+        for lxml in (get_favicon_url._lxml_etree, None):
+            for body, honor_continuation, href, ranges in cases:
+                with self.subTest(
+                    lxml=lxml is not None,
+                    href=href,
+                    honor_continuation=honor_continuation,
+                ), unittest.mock.patch.object(
+                    get_favicon_url, "_lxml_etree", lxml
+                ):
+                    session, requested = fake_session(body, honor_continuation)
+                    parser, _ = get_favicon_url._get_remote_file(
+                        "http://example.com/", None, 65536, session
+                    )
+                    assert parser is not None
+                    self.assertEqual(
+                        [x["href"] for x in parser.favicons], [href]
+                    )
+                    self.assertEqual(requested, ranges)
+
+    def test_rel_case_insensitive(self):
+        page = (
+            "<html><head><link rel='stylesheet' href='a.css'>"
+            "<link rel=' Shortcut ICON ' href='b.ico'><link rel href='c.ico'>"
+            "</head></html>"
+        )
+        parsers = [get_favicon_url._IconHTMLParser()]
+        if get_favicon_url._lxml_etree is not None:
+            parsers.append(get_favicon_url._LxmlIconParser())
+        for parser in parsers:
+            with self.subTest(parser=type(parser).__name__):
+                with self.assertRaises(get_favicon_url._StopSearch):
+                    parser.feed(page)
+                self.assertEqual(
+                    [icon["href"] for icon in parser.favicons], ["b.ico"]
+                )
@@ -1,5 +1,6 @@
 import unittest
 import io
+import struct
 from PIL import Image
 
 import icon
@@ -18,3 +19,48 @@ class IconTest(unittest.TestCase):
         with io.BytesIO(new_icon.x16) as f:
             x16 = Image.open(f)
             self.assertEqual(x16.size, (16, 16))
+
+    def test_ico_png_frames(self):
+        image = Image.new("RGBA", (64, 64), "blue")
+        for bitmap_format in ("png", "bmp"):
+            with self.subTest(bitmap_format=bitmap_format):
+                with io.BytesIO() as f:
+                    image.save(
+                        f,
+                        "ICO",
+                        sizes=[(16, 16), (32, 32)],
+                        bitmap_format=bitmap_format,
+                    )
+                    ico = f.getvalue()
+                new_icon = icon.IconPair.create_from_ico(ico)
+
+                for data, size in ((new_icon.x16, 16), (new_icon.x32, 32)):
+                    with io.BytesIO(data) as f:
+                        converted = Image.open(f)
+                        self.assertEqual(converted.format, "PNG")
+                        self.assertEqual(converted.size, (size, size))
+                    # PNG frames should be copied verbatim.
+                    self.assertEqual(data in ico, bitmap_format == "png")
+
+    def test_handmade_ico(self):
+        # Build the ICO by hand so that the test doesn't depend on how the
+        # installed PIL version stores ICO directory entries.
+        frames = []
+        for size in (32, 16):
+            with io.BytesIO() as f:
+                Image.new("RGBA", (size, size), "red").save(f, "PNG")
+                frames.append((size, f.getvalue()))
+
+        header = struct.pack("<HHH", 0, 1, len(frames))
+        offset = len(header) + 16 * len(frames)
+        entries = b""
+        for size, data in frames:
+            entries += struct.pack(
+                "<BBBBHHII", size, size, 0, 0, 1, 32, len(data), offset
+            )
+            offset += len(data)
+        ico = header + entries + b"".join(data for _, data in frames)
+
+        new_icon = icon.IconPair.create_from_ico(ico)
+        self.assertEqual(new_icon.x32, frames[0][1])
+        self.assertEqual(new_icon.x16, frames[1][1])
@@ -0,0 +1,214 @@
+import unittest
+import unittest.mock
+import io
+import types
+import concurrent.futures
+import requests
+from PIL import Image
+
+import get_favicon_url
+import icon
+import load_bookmark_favicons
+
+
+class QueryFaviconsTest(unittest.TestCase):
+    def test_origin_fallback(self):
+        favicons = {
+            "http://a.test/": None,
+            "http://a.test/page": "http://a.test/page.ico",
+            "http://b.test/": "http://b.test/b.ico",
+            # The root page isn't HTML, the favicon is only guessed.
+            "http://c.test/": "http://c.test/favicon.ico",
+            "http://c.test/page": "http://c.test/page.ico",
+            "http://c.test/other": None,
+        }
+        queried = []
+
+        def fake_get_favicon_url(url, timeout, session=None):
+            queried.append(url)
+            return favicons[url]
+
+        bookmarks = {
+            "http://a.test/",
+            "http://a.test/page",
+            "http://b.test/x",
+            "http://b.test/y",
+            "http://c.test/page",
+            "http://c.test/other",
+        }
+        with unittest.mock.patch.object(
+            get_favicon_url, "get_favicon_url", fake_get_favicon_url
+        ):
+            result = load_bookmark_favicons.query_favicons(
+                bookmarks, None, False, None
+            )
+
+        self.assertEqual(
+            result,
+            {
+                "http://a.test/page": "http://a.test/page.ico",
+                "http://b.test/x": "http://b.test/b.ico",
+                "http://b.test/y": "http://b.test/b.ico",
+                "http://c.test/page": "http://c.test/page.ico",
+                "http://c.test/other": "http://c.test/favicon.ico",
+            },
+        )
+        # The root page of a.test must not be queried again.
+        self.assertCountEqual(
+            queried,
+            [
+                "http://a.test/",
+                "http://b.test/",
+                "http://c.test/",
+                "http://a.test/page",
+                "http://c.test/page",
+                "http://c.test/other",
+            ],
+        )
+
+
+class ConvertFaviconTest(unittest.TestCase):
+    def test_guess_image_type(self):
+        guess = load_bookmark_favicons._guess_image_type
+        svg = b'<svg xmlns="http://www.w3.org/2000/svg"></svg>'
+        self.assertEqual(guess(b"\x00\x00\x01\x00\x01\x00"), "ico")
+        self.assertEqual(guess(svg), "svg")
+        self.assertEqual(guess(b'<?xml version="1.0"?>\n' + svg), "svg")
+        self.assertEqual(guess(b"\xef\xbb\xbf\n  " + svg), "svg")
+        self.assertEqual(
+            guess(b'\xef\xbb\xbf<?xml version="1.0"?>' + svg), "svg"
+        )
+        self.assertIsNone(guess(b'<?xml version="1.0"?>\n<html></html>'))
+        with open("tests/sample-data/facebook16.png", "rb") as f:
+            self.assertIsNone(guess(f.read()))
+        self.assertIsNone(guess(b""))
+
+    def test_convert_favicon(self):
+        image = Image.new("RGBA", (48, 48), "green")
+        with io.BytesIO() as f:
+            image.save(f, "ICO", sizes=[(16, 16), (32, 32)])
+            ico = f.getvalue()
+        with io.BytesIO() as f:
+            image.save(f, "PNG")
+            png = f.getvalue()
+
+        for data in (ico, png):
+            converted = load_bookmark_favicons._convert_favicon(data)
+            with io.BytesIO(converted.x32) as f:
+                self.assertEqual(Image.open(f).size, (32, 32))
+
+        self.assertRaises(
+            icon.UnidentifiedImageError,
+            load_bookmark_favicons._convert_favicon,
+            b"definitely not an image",
+        )
+
+    def test_convert_svg_by_content_type(self):
+        # The prefix check doesn't recognise an SVG starting with a comment,
+        # the declared MIME type is used then.
+        svg = b'<!-- x --><svg xmlns="http://www.w3.org/2000/svg"></svg>'
+        with unittest.mock.patch.object(
+            icon.IconPair, "create_from_svg"
+        ) as create_from_svg:
+            load_bookmark_favicons._convert_favicon(svg, "image/svg+xml")
+        create_from_svg.assert_called_once_with(svg)
+
+
+class _Body(io.BytesIO):
+    """Response body which remembers how much of it has been read."""
+
+    read_size = 0
+
+    def close(self):
+        self.read_size = self.tell()
+        super().close()
+
+
+class FetchFaviconTest(unittest.TestCase):
+    @staticmethod
+    def session(body: _Body, headers: dict[str, str]):
+        """Create a fake session serving body with headers."""
+
+        def get(url, timeout, stream, headers=None):
+            response = requests.Response()
+            response.status_code = 200
+            response.url = url
+            response.raw = body
+            response.headers.update(response_headers)
+            return response
+
+        response_headers = headers
+        return types.SimpleNamespace(get=get)
+
+    def test_small_favicon(self):
+        body = _Body(b"icon")
+        session = self.session(body, {"Content-Type": "Image/PNG; x=y"})
+        self.assertEqual(
+            load_bookmark_favicons._fetch_favicon(
+                "http://a.test/favicon.ico", None, session
+            ),
+            (b"icon", "image/png"),
+        )
+
+    def test_large_content_length(self):
+        body = _Body(b"icon")
+        size = load_bookmark_favicons._MAX_FAVICON_SIZE + 1
+        session = self.session(body, {"Content-Length": str(size)})
+        with self.assertRaisesRegex(
+            load_bookmark_favicons._FetchError, "too large"
+        ):
+            load_bookmark_favicons._fetch_favicon(
+                "http://a.test/favicon.ico", None, session
+            )
+        # The body mustn't be downloaded at all.
+        self.assertEqual(body.read_size, 0)
+
+    def test_large_body(self):
+        size = load_bookmark_favicons._MAX_FAVICON_SIZE + 1
+        body = _Body(b"x" * (size + 1024 * 1024))
+        session = self.session(body, {})
+        with self.assertRaisesRegex(
+            load_bookmark_favicons._FetchError, "too large"
+        ):
+            load_bookmark_favicons._fetch_favicon(
+                "http://a.test/favicon.ico", None, session
+            )
+        # Downloading stops soon after the limit is exceeded.
+        self.assertLess(body.read_size, size + 65536)
+
+
+class _ThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+    """ThreadPoolExecutor accepting ProcessPoolExecutor's arguments."""
+
+    def __init__(self, mp_context=None):
+        super().__init__()
+
+
+class ConvertFaviconImagesTest(unittest.TestCase):
+    def test_identical_images_converted_once(self):
+        converted = icon.IconPair(b"x16", b"x32")
+        with unittest.mock.patch.object(
+            concurrent.futures, "ProcessPoolExecutor", _ThreadPoolExecutor
+        ), unittest.mock.patch.object(
+            load_bookmark_favicons, "_convert_favicon", return_value=converted
+        ) as convert:
+            result = load_bookmark_favicons.convert_favicon_images(
+                [
+                    ("http://a.test/favicon.ico", b"same", None),
+                    ("http://b.test/favicon.ico", b"same", "image/png"),
+                    ("http://c.test/favicon.ico", b"other", None),
+                ],
+                False,
+            )
+
+        self.assertEqual(convert.call_count, 2)
+        convert.assert_any_call(b"same", None)
+        convert.assert_any_call(b"other", None)
+        self.assertCountEqual(
+            result,
+            [
+                ("http://a.test/favicon.ico", converted),
+                ("http://b.test/favicon.ico", converted),
+                ("http://c.test/favicon.ico", converted),
+            ],
+        )